@@ -1,5 +1,6 @@
 from typing import List, Optional
 
+from beanie import PydanticObjectId
 from fastapi import Depends, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
@@ -10,10 +11,22 @@ from app.common.http_exception import (
 )
 from app.core.security import ACCESS_JWT
 from app.db import SessionManager
+from app.service import businessService
 
 security = HTTPBearer(auto_error=False)
 
 
+def get_http(request: Request):
+    # Client httpx dùng chung, khởi tạo trong lifespan
+    return request.app.state.http
+
+
+async def get_current_business(request: Request):
+    # FastAPI cache dependency theo request: các handler cùng cần doanh nghiệp
+    # của caller chỉ tốn 1 truy vấn, không fetch lại trong từng handler
+    return await businessService.find(request.state.user_scope_oid)
+
+
 def login_required(
     request: Request,
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
@@ -39,6 +52,14 @@ def login_required(
             if key == "exp":
                 continue
             setattr(request.state, key, value)
+        # Giữ payload đã decode: handler cần lại claims thì đọc state, khỏi verify HMAC lần nữa
+        request.state.jwt_payload = payload
+        # Parse ObjectId 1 lần cho cả request, handler không phải parse lại
+        request.state.user_id_oid = PydanticObjectId(payload["user_id"])
+        user_scope = payload.get("user_scope")
+        request.state.user_scope_oid = PydanticObjectId(user_scope) if user_scope else None
+        user_branch = payload.get("user_branch")
+        request.state.user_branch_oid = PydanticObjectId(user_branch) if user_branch else None
         return True
     except Exception as e:
         raise HTTP_401_UNAUTHORZIED(
@@ -47,25 +68,42 @@ def login_required(
         ) from e
 
 
+# Memo checker theo bộ tham số: các route dùng chung role/permission nhận về
+# đúng 1 callable, FastAPI chỉ inspect 1 lần và cache dependency theo request hiệu quả
+_role_checkers: dict = {}
+_permission_checkers: dict = {}
+
+
 def role_required(role: List[str] = None):
+    key = tuple(role) if role is not None else None
+    if key in _role_checkers:
+        return _role_checkers[key]
+    # frozenset dựng 1 lần lúc khai báo route, checker chỉ còn phép thuộc O(1)
+    roles = frozenset(role) if role is not None else None
+
     def role_checker(request: Request):
-        user_role = request.state.user_role
-        if role is not None and user_role not in role:
+        if roles is not None and request.state.user_role not in roles:
             raise HTTP_403_FORBIDDEN(get_message(KeyResponse.PERMISSION_DENIED))
         return True
 
+    _role_checkers[key] = role_checker
     return role_checker
 
 
 def permission_required(permissions: List[int] = None) -> bool:
+    key = tuple(permissions) if permissions is not None else None
+    if key in _permission_checkers:
+        return _permission_checkers[key]
+    # frozenset dựng 1 lần lúc khai báo route, checker chỉ còn phép tập con
+    perms = frozenset(permissions) if permissions is not None else None
+
     def permission_checker(request: Request):
-        user_permissions: List[int] = request.state.user_permissions
-        if permissions is not None:
-            if not all(perm in user_permissions for perm in permissions):
-                raise HTTP_403_FORBIDDEN(get_message(KeyResponse.PERMISSION_DENIED))
+        if perms is not None and not perms.issubset(request.state.user_permissions):
+            raise HTTP_403_FORBIDDEN(get_message(KeyResponse.PERMISSION_DENIED))
         return True
 
+    _permission_checkers[key] = permission_checker
     return permission_checker
 
 
-__all__ = ["login_required", "role_required", "permission_required"]
+__all__ = ["get_current_business", "get_http", "login_required", "role_required", "permission_required"]
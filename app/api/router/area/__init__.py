@@ -3,12 +3,13 @@ from typing import List, Optional
 from beanie import PydanticObjectId
 from fastapi import APIRouter, Depends, Query, Request
 
-from app.api.dependency import login_required, permission_required, role_required
+from app.api.dependency import get_current_business, login_required, permission_required, role_required
 from app.common.api_response import Response
 from app.common.http_exception import HTTP_404_NOT_FOUND, HTTP_409_CONFLICT
+from app.common.utils import ref_id
 from app.db import Mongo
 from app.schema.area import AreaCreate, AreaResponse, AreaUpdate
-from app.service import areaService, branchService, businessService, unitService
+from app.service import areaService, branchService, unitService
 
 apiRouter = APIRouter(
     tags=["Area"],
@@ -29,13 +30,41 @@ apiRouter = APIRouter(
 )
 async def view_areas(request: Request, branch: Optional[PydanticObjectId] = Query(default=None)):
     conditions = {
-        "business._id": PydanticObjectId(request.state.user_scope),
+        "business.$id": request.state.user_scope_oid,
     }
     if branch:
-        conditions["branch._id"] = branch
-    areas = await areaService.find_many(
-        conditions,
-        fetch_links=True,
+        conditions["branch.$id"] = branch
+    # Chỉ join branch (AreaResponse không render business) và project đúng field cần
+    areas = await areaService.aggregate(
+        [
+            {"$match": conditions},
+            {
+                "$lookup": {
+                    "from": "Branch",
+                    "localField": "branch.$id",
+                    "foreignField": "_id",
+                    "as": "branch",
+                }
+            },
+            {"$unwind": {"path": "$branch", "preserveNullAndEmptyArrays": True}},
+            {
+                "$project": {
+                    "name": 1,
+                    "description": 1,
+                    "image_url": 1,
+                    "created_at": 1,
+                    "updated_at": 1,
+                    "branch": {
+                        "_id": 1,
+                        "name": 1,
+                        "address": 1,
+                        "contact": 1,
+                        "created_at": 1,
+                        "updated_at": 1,
+                    },
+                }
+            },
+        ]
     )
     return Response(data=areas)
 
@@ -47,17 +76,20 @@ async def view_areas(request: Request, branch: Optional[PydanticObjectId] = Quer
     response_model=Response[AreaResponse],
     dependencies=[Depends(permission_required(permissions=["create.area"]))],
 )
-async def post_area(data: AreaCreate, request: Request):
-    business = await businessService.find(request.state.user_scope)
+async def post_area(data: AreaCreate, business=Depends(get_current_business)):
     branch = await branchService.find(data.branch)
-    if branch is None or branch.business.to_ref().id != business.id:
+    if branch is None or ref_id(branch.business) != business.id:
         raise HTTP_404_NOT_FOUND("Không tìm thấy chi nhánh")
-    if await areaService.find_one({"branch.$id": branch.id, "name": {"$regex": f"^{data.name}$", "$options": "i"}}):
+    if await areaService.find_one(
+        {"branch.$id": branch.id, "name": data.name},
+        collation={"locale": "en", "strength": 2},
+    ):
         raise HTTP_409_CONFLICT("Khu vực đã tồn tại")
     data = data.model_dump()
     data["business"] = business
     area = await areaService.insert(data)
-    await area.fetch_link("branch")
+    # branch đã được fetch ở trên, gán lại thay vì fetch_link thêm 1 round-trip
+    area.branch = branch
     return Response(data=area)
 
 
@@ -72,13 +104,14 @@ async def put_area(id: PydanticObjectId, data: AreaUpdate, request: Request):
     area = await areaService.find(id)
     if area is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy khu vực")
-    if area.business.to_ref().id != PydanticObjectId(request.state.user_scope):
+    if ref_id(area.business) != request.state.user_scope_oid:
         raise HTTP_404_NOT_FOUND("Không tìm thấy khu vực")
     area = await areaService.find_one(
         {
-            "branch.$id": area.branch.to_ref().id,
-            "name": {"$regex": f"^{data.name}$", "$options": "i"},
-        }
+            "branch.$id": ref_id(area.branch),
+            "name": data.name,
+        },
+        collation={"locale": "en", "strength": 2},
     )
     if area is not None and area.id != id:
         raise HTTP_409_CONFLICT("Khu vực đã tồn tại")
@@ -99,7 +132,7 @@ async def delete_area(id: PydanticObjectId, request: Request):
         area = await areaService.find(id, session)
         if area is None:
             raise HTTP_404_NOT_FOUND("Không tìm thấy khu vực trong doanh nghiệp của bạn")
-        if area.business.to_ref().id != PydanticObjectId(request.state.user_scope):
+        if ref_id(area.business) != request.state.user_scope_oid:
             raise HTTP_404_NOT_FOUND("Không tìm thấy khu vực trong doanh nghiệp của bạn")
         await areaService.delete(id)
         await unitService.delete_many(conditions={"area.$id": id})
@@ -1,13 +1,13 @@
+import asyncio
 from datetime import datetime, timedelta
 from urllib.parse import urljoin
 
-from beanie import PydanticObjectId
 from fastapi import APIRouter, BackgroundTasks, Depends, File, Query, Request, UploadFile
 from fastapi.responses import HTMLResponse
 from fastapi_mail import MessageSchema, MessageType
 from jwt.exceptions import ExpiredSignatureError
 
-from app.api.dependency import login_required, role_required
+from app.api.dependency import get_current_business, login_required, role_required
 from app.common.api_message import KeyResponse, get_message
 from app.common.api_response import Response
 from app.common.http_exception import (
@@ -16,12 +16,13 @@ from app.common.http_exception import (
     HTTP_403_FORBIDDEN,
     HTTP_404_NOT_FOUND,
 )
+from app.common.utils import ref_id, render_email_template, sniff_image_type
 from app.core.config import settings
 from app.core.decorator import limiter
 from app.core.security import ACCESS_JWT, REFRESH_JWT
-from app.db import QRCode, SessionManager
+from app.db import PermissionCache, QRCode, SessionManager
 from app.schema.business import FullBusinessResponse
-from app.schema.permission import PermissionProjection
+from app.schema.permission import DetailPermissionResponse
 from app.schema.user import (
     Auth,
     ChangePassword,
@@ -33,7 +34,7 @@ from app.schema.user import (
     UserResponse,
     UserUpdate,
 )
-from app.service import businessService, groupService, permissionService, userService
+from app.service import businessService, permissionService, userService
 
 apiRouter = APIRouter(
     tags=["Auth"],
@@ -57,34 +58,19 @@ async def sign_in(data: Auth, request: Request):
     if not user.available:
         raise HTTP_403_FORBIDDEN("Tài khoản hiện bị khóa")
     if user.role in ["BusinessOwner", "Staff"]:
-        business = await businessService.find(user.business.to_ref().id)
+        business = await businessService.find(ref_id(user.business))
         if business.expired_at < datetime.now():
             raise HTTP_403_FORBIDDEN("Tài khoản doanh nghiệp đã hết hạn")
     # ---- #
     user_id = str(user.id)
     user_role = str(user.role)
-    user_scope = str(user.business.to_ref().id) if user.business else None
-    user_group = [group.to_ref().id for group in user.group] if user.group else []
-    user_permissions = [permission.to_ref().id for permission in user.permissions]
-    # Find Group #
-    if user_group:
-        # Thêm quyền của nhóm vào user_permission
-        group_permissions = set()
-        groups = await groupService.find_many(
-            {"_id": {"$in": user_group}},
-        )
-        for group in groups:
-            group_permissions.update(group.permissions)
-        group_permissions = list(group_permissions)
-        group_permissions = [permission.to_ref().id for permission in group_permissions]
-        # - #
-        user_permissions.extend(group_permissions)
-        user_group = [str(object_id) for object_id in user_group]
-    user_permissions = await permissionService.find_many(
-        {"_id": {"$in": user_permissions}},
-        projection_model=PermissionProjection,
-    )
-    user_permissions = [p.code for p in user_permissions]
+    user_scope = str(ref_id(user.business)) if user.business else None
+    # Quyền trực tiếp + quyền theo nhóm: cache theo (user_id, perms_version),
+    # miss thì chạy 1 aggregation thay vì 3 truy vấn
+    user_permissions = PermissionCache.get_codes(user_id, user.perms_version)
+    if user_permissions is None:
+        user_permissions = await userService.resolve_permissions(user.id)
+        PermissionCache.set_codes(user_id, user.perms_version, user_permissions)
     payload = {
         "user_id": user_id,
         "user_scope": user_scope,
@@ -114,8 +100,8 @@ async def sign_in(data: Auth, request: Request):
 def sign_out(data: Session, request: Request):
     if SessionManager.get(request.state.user_id) != data.refresh_token:
         raise HTTP_403_FORBIDDEN("Đăng xuất thất bại")
-    SessionManager.delete(request.state.user_id)
-    if SessionManager.get(request.state.user_id):
+    # DEL trả về số key đã xóa nên không cần GET kiểm tra lại
+    if not SessionManager.delete(request.state.user_id):
         raise HTTP_403_FORBIDDEN("Đăng xuất thất bại")
     return Response(data="Đăng xuất thành công")
 
@@ -139,14 +125,13 @@ async def post_reset_password(
     data: ResetPassword,
     background_tasks: BackgroundTasks,
 ):
-    def render_email_template(template_name: str, context: dict) -> str:
-        from jinja2 import Environment, FileSystemLoader
-
-        env = Environment(loader=FileSystemLoader("app/templates"))
-        template = env.get_template(template_name)
-        return template.render(**context)
-
-    account = await userService.find_one(conditions=data.model_dump())
+    # Điều kiện tường minh: username đi qua unique index, email so khớp trên doc duy nhất
+    account = await userService.find_one(
+        conditions={
+            "username": data.username,
+            "email": data.email,
+        }
+    )
     if account is None or not account.email_verified:
         raise HTTP_404_NOT_FOUND("Không tìm thấy tài khoản")
     # ---- #
@@ -189,7 +174,7 @@ async def put_reset_password(data: NewPassword):
     user = await userService.find(payload.get("user_id"))
     if user is None:
         raise HTTP_404_NOT_FOUND("Người dùng không tồn tại")
-    user = user.change_password(data.password)
+    user = await user.change_password(data.password)
     await user.save()
     return Response(data=True)
 
@@ -204,7 +189,7 @@ async def change_password(data: ChangePassword, request: Request):
     user = await userService.find(request.state.user_id)
     if not user.verify_password(data.old_password):
         raise HTTP_403_FORBIDDEN("Mật khẩu hiện tại không chính xác.")
-    user = user.change_password(data.new_password)
+    user = await user.change_password(data.new_password)
     await user.save()
     return Response(data=user)
 
@@ -256,13 +241,6 @@ async def confirm_email(
 )
 @limiter(max_request=1, duration=1800)
 async def verify_email(request: Request, task: BackgroundTasks):
-    def render_email_template(template_name: str, context: dict) -> str:
-        from jinja2 import Environment, FileSystemLoader
-
-        env = Environment(loader=FileSystemLoader("app/templates"))
-        template = env.get_template(template_name)
-        return template.render(**context)
-
     user = await userService.find(request.state.user_id)
     if user.email is None:
         raise HTTP_400_BAD_REQUEST("Email chưa được thiết lập.")
@@ -304,16 +282,22 @@ async def upload_logo(
 ):
     if logo.content_type not in {"image/jpeg", "image/png", "image/webp"}:
         raise HTTP_400_BAD_REQUEST(message="Chỉ chấp nhận JPG, PNG, WEBP.")
-    contents = await logo.read()
-    if len(contents) > 2 * 1024 * 1024:  # 2MB:
+    # Kiểm tra magic bytes trước khi đụng tới phần thân còn lại
+    header = await logo.read(12)
+    await logo.seek(0)
+    if sniff_image_type(header) is None:
+        raise HTTP_400_BAD_REQUEST(message="Chỉ chấp nhận JPG, PNG, WEBP.")
+    if logo.size and logo.size > 2 * 1024 * 1024:  # 2MB:
         raise HTTP_400_BAD_REQUEST(message="Ảnh vượt quá 2MB")
-    object_name = QRCode.upload(
-        object=contents,
+    # Stream thẳng file tạm lên MinIO trong thread, không buffer bytes và không chặn event loop
+    object_name = await asyncio.to_thread(
+        QRCode.upload,
+        object=logo.file,
         object_name=f"/logo/{request.state.user_id}_{logo.filename}",
         content_type=logo.content_type,
     )
     if not await businessService.update(
-        id=PydanticObjectId(request.state.user_scope), data={"logo": QRCode.get_url(object_name)}
+        id=request.state.user_scope_oid, data={"logo": QRCode.get_url(object_name)}
     ):
         raise HTTP_400_BAD_REQUEST("Tải ảnh thất bại")
     return Response(data=True)
@@ -334,11 +318,15 @@ async def upload_avatar(
 ):
     if avatar.content_type not in {"image/jpeg", "image/png", "image/webp"}:
         raise HTTP_400_BAD_REQUEST(message="Chỉ chấp nhận JPG, PNG, WEBP.")
-    contents = await avatar.read()
-    if len(contents) > 2 * 1024 * 1024:  # 2MB:
+    header = await avatar.read(12)
+    await avatar.seek(0)
+    if sniff_image_type(header) is None:
+        raise HTTP_400_BAD_REQUEST(message="Chỉ chấp nhận JPG, PNG, WEBP.")
+    if avatar.size and avatar.size > 2 * 1024 * 1024:  # 2MB:
         raise HTTP_400_BAD_REQUEST(message="Ảnh vượt quá 2MB")
-    object_name = QRCode.upload(
-        object=contents,
+    object_name = await asyncio.to_thread(
+        QRCode.upload,
+        object=avatar.file,
         object_name=f"/avatar/{request.state.user_id}_{avatar.filename}",
         content_type=avatar.content_type,
     )
@@ -383,7 +371,11 @@ async def put_me(data: UserUpdate, request: Request):
 )
 async def my_permission(request: Request):
     codes = request.state.user_permissions
-    permissions = await permissionService.find_many({"code": {"$in": codes}})
+    # Chỉ project các field FE dùng thay vì materialize nguyên document
+    permissions = await permissionService.find_many(
+        {"code": {"$in": codes}},
+        projection_model=DetailPermissionResponse,
+    )
     return Response(data=permissions)
 
 
@@ -398,7 +390,7 @@ async def my_permission(request: Request):
         Depends(role_required(role=["BusinessOwner"])),
     ],
 )
-async def my_business(request: Request):
-    business = await businessService.find(request.state.user_scope)
-    await business.fetch_all_links()
+async def my_business(business=Depends(get_current_business)):
+    # Response đã exclude owner nên chỉ cần join business_type
+    await business.fetch_link("business_type")
     return Response(data=business)
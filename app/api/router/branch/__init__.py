@@ -1,11 +1,13 @@
+import asyncio
 from typing import List
 
 from beanie import PydanticObjectId
 from fastapi import APIRouter, Depends, Request
 
-from app.api.dependency import login_required, permission_required, role_required
+from app.api.dependency import get_current_business, login_required, permission_required, role_required
 from app.common.api_response import Response
 from app.common.http_exception import HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND, HTTP_409_CONFLICT
+from app.common.utils import ref_id
 from app.db import Mongo
 from app.schema.branch import BranchCreateWithoutBusiness, BranchResponse, BranchUpdate
 from app.service import areaService, branchService, businessService, unitService, userService
@@ -28,8 +30,7 @@ apiRouter = APIRouter(
     dependencies=[Depends(permission_required(permissions=["view.branch"]))],
 )
 async def get_branchs(request: Request):
-    business_id = request.state.user_scope
-    branches = await branchService.find_many(conditions={"business.$id": PydanticObjectId(business_id)})
+    branches = await branchService.find_many(conditions={"business.$id": request.state.user_scope_oid})
     return Response(data=branches)
 
 
@@ -40,13 +41,13 @@ async def get_branchs(request: Request):
     response_model=Response[BranchResponse],
     dependencies=[Depends(permission_required(permissions=["create.branch"]))],
 )
-async def post_branch(data: BranchCreateWithoutBusiness, request: Request):
-    business = await businessService.find(request.state.user_scope)
+async def post_branch(data: BranchCreateWithoutBusiness, business=Depends(get_current_business)):
     if branch := await branchService.find_one(
         conditions={
             "business.$id": business.id,
             "name": data.name,
-        }
+        },
+        collation={"locale": "en", "strength": 2},
     ):
         raise HTTP_409_CONFLICT(f"Chi nhánh {data.name} đã tồn tại")
     if data.contact is None:
@@ -68,11 +69,11 @@ async def update_branch(id: PydanticObjectId, data: BranchUpdate, request: Reque
     branch = await branchService.find(id)
     if branch is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy")
-    branch_scope = branch.business.to_ref().id
-    user_scope = PydanticObjectId(request.state.user_scope)
+    branch_scope = ref_id(branch.business)
+    user_scope = request.state.user_scope_oid
     if branch_scope != user_scope:
         raise HTTP_403_FORBIDDEN("Bạn không đủ quyền thực hiện hành động này")
-    branch = await branchService.update(id=id, data=data.model_dump(exclude_none=True))
+    branch = await branchService.update(id=id, data=data)
     return Response(data=branch)
 
 
@@ -87,12 +88,15 @@ async def delete_branch(id: PydanticObjectId, request: Request):
         branch = await branchService.find(id, session=session)
         if branch is None:
             raise HTTP_404_NOT_FOUND("Không tìm thấy chi nhánh")
-        branch_scope = branch.business.to_ref().id
-        user_scope = PydanticObjectId(request.state.user_scope)
+        branch_scope = ref_id(branch.business)
+        user_scope = request.state.user_scope_oid
         if branch_scope != user_scope:
             raise HTTP_403_FORBIDDEN("Bạn không đủ quyền thực hiện hành động này")
         await branchService.delete(id, session=session)
-        await userService.delete_many(conditions={"branch.$id": id})
-        await areaService.delete_many(conditions={"branch.$id": id})
-        await unitService.delete_many(conditions={"branch.$id": id})
+        # 3 cascade delete độc lập (không chung session) nên chạy song song
+        await asyncio.gather(
+            userService.delete_many(conditions={"branch.$id": id}),
+            areaService.delete_many(conditions={"branch.$id": id}),
+            unitService.delete_many(conditions={"branch.$id": id}),
+        )
     return Response(data="Xóa thành công")
@@ -1,16 +1,19 @@
+import re
 from datetime import datetime, timedelta
 from typing import List, Optional
 
 from beanie import PydanticObjectId
+from bson import DBRef
 from fastapi import APIRouter, Depends, Query
 
 from app.api.dependency import login_required, permission_required, role_required
 from app.common.api_response import Response
 from app.common.http_exception import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_409_CONFLICT
+from app.common.utils import ref_id
 from app.core.config import settings
 from app.db import Mongo
 from app.schema.branch import BranchCreate
-from app.schema.business import BusinessCreate, BusinessResponse, BusinessUpdate, ExtendBusiness, FullBusinessResponse
+from app.schema.business import BusinessResponse, BusinessUpdate, ExtendBusiness, FullBusinessResponse
 from app.schema.user import BusinessOwner, BusinessRegister, FullUserResponse
 from app.service import branchService, businessService, businessTypeService, userService
 
@@ -41,10 +44,41 @@ async def get_businesses(
     if available is not None:
         conditions["available"] = available
     if type:
-        types = await businessTypeService.find_many({"name": {"$regex": type, "$options": "i"}})
+        # Prefix regex (đã escape) trên name_lc tận dụng được b-tree index
+        types = await businessTypeService.find_many({"name_lc": {"$regex": f"^{re.escape(type.lower())}"}})
         type_ids = [type.id for type in types]
-        conditions["business_type._id"] = {"$in": type_ids}
-    businesses = await businessService.find_many(conditions, skip=(page - 1) * limit, limit=limit, fetch_links=True)
+        conditions["business_type.$id"] = {"$in": type_ids}
+    # Join đúng business_type (BusinessResponse không render owner) và project field cần
+    businesses = await businessService.aggregate(
+        [
+            {"$match": conditions},
+            {"$skip": (page - 1) * limit},
+            {"$limit": limit},
+            {
+                "$lookup": {
+                    "from": "BusinessType",
+                    "localField": "business_type.$id",
+                    "foreignField": "_id",
+                    "as": "business_type",
+                }
+            },
+            {"$unwind": {"path": "$business_type", "preserveNullAndEmptyArrays": True}},
+            {
+                "$project": {
+                    "name": 1,
+                    "address": 1,
+                    "contact": 1,
+                    "logo": 1,
+                    "tax_code": 1,
+                    "available": 1,
+                    "business_type": 1,
+                    "expired_at": 1,
+                    "created_at": 1,
+                    "updated_at": 1,
+                }
+            },
+        ]
+    )
     return Response(data=businesses)
 
 
@@ -99,22 +133,33 @@ async def post_business(data: BusinessRegister):
         type = await businessTypeService.find(data.business_type, session)
         if type is None:
             raise HTTP_400_BAD_REQUEST("Loại doanh nghiệp không phù hợp")
-        if await businessService.find_one({"name": data.business_name}, session=session):
-            raise HTTP_409_CONFLICT("Tên doanh nghiệp đã được đăng kí")
+        # Gộp kiểm tra tên + mã số thuế thành 1 truy vấn $or
+        unique_checks = [{"name": data.business_name}]
+        if data.business_tax_code:
+            unique_checks.append({"tax_code": data.business_tax_code})
+        if existed := await businessService.find_one({"$or": unique_checks}, session=session):
+            if existed.name == data.business_name:
+                raise HTTP_409_CONFLICT("Tên doanh nghiệp đã được đăng kí")
+            raise HTTP_409_CONFLICT("Mã số thuế đã được sử dụng")
         if await userService.find_one(
             {"username": data.username},
         ):
             raise HTTP_409_CONFLICT("Tên đăng nhập đã được đăng kí")
-        if data.business_tax_code:
-            if await businessService.find_one({"tax_code": data.business_tax_code}, session=session):
-                raise HTTP_409_CONFLICT("Mã số thuế đã được sử dụng")
-        business = BusinessCreate(
-            name=data.business_name,
-            address=data.business_address,
-            contact=data.business_contact,
-            business_type=type,
-            tax_code=data.business_tax_code,
-            owner=None,
+        # Sinh id trước để business và owner trỏ lẫn nhau ngay khi insert,
+        # bỏ hẳn 2 lần update vòng tròn sau đó
+        business_id = PydanticObjectId()
+        owner_id = PydanticObjectId()
+        business = await businessService.insert(
+            {
+                "id": business_id,
+                "name": data.business_name,
+                "address": data.business_address,
+                "contact": data.business_contact,
+                "business_type": type,
+                "tax_code": data.business_tax_code,
+                "owner": DBRef("User", owner_id),
+            },
+            session=session,
         )
         owner = BusinessOwner(
             username=data.username,
@@ -122,23 +167,10 @@ async def post_business(data: BusinessRegister):
             name=data.owner_name,
             phone=data.owner_contact,
             address=data.owner_address,
-        )
-        business = await businessService.insert(business, session=session)
+        ).model_dump()
+        owner["id"] = owner_id
+        owner["business"] = DBRef("Business", business_id)
         owner = await userService.insert(owner, session=session)
-        business = await businessService.update(
-            id=business.id,
-            data={
-                "owner": owner,
-            },
-            session=session,
-        )
-        await userService.update(
-            id=owner.id,
-            data={
-                "business": business,
-            },
-            session=session,
-        )
         await branchService.insert(
             BranchCreate(
                 name=data.business_name,
@@ -148,12 +180,9 @@ async def post_business(data: BusinessRegister):
             ),
             session=session,
         )
-    user = await userService.find_one(
-        conditions={"username": data.username},
-        fetch_links=True,
-        projection_model=FullUserResponse,
-    )
-    return Response(data=user)
+    # Đủ dữ liệu trong tay, dựng response trực tiếp thay vì find_one + fetch_links
+    owner.business = business
+    return Response(data=FullUserResponse.model_validate(owner))
 
 
 @apiRouter.post(
@@ -203,19 +232,19 @@ async def lock_unlock_business(id: PydanticObjectId):
         business = await businessService.find(id, session=session)
         if business is None:
             raise HTTP_404_NOT_FOUND("Không tìm thấy doanh nghiệp")
-        business = await businessService.update(
-            id=id,
-            data={
-                "available": not business.available,
-            },
+        # Toggle tính 1 lần, ghi $set trực tiếp (mỗi update 1 RTT thay vì get + save)
+        available = not business.available
+        await businessService.update_many(
+            conditions={"_id": id},
+            update_data={"$set": {"available": available}},
             session=session,
         )
-        await userService.update(
-            id=business.owner.to_ref().id,
-            data={
-                "available": business.available,
-            },
+        await userService.update_many(
+            conditions={"_id": ref_id(business.owner)},
+            update_data={"$set": {"available": available}},
             session=session,
         )
+        # Doc đã có trong tay, chỉ cần cập nhật cờ và join business_type cho response
+        business.available = available
         await business.fetch_link("business_type")
         return Response(data=business)
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from beanie import PydanticObjectId
 from fastapi import APIRouter, Depends, Query
@@ -29,11 +29,17 @@ apiRouter = APIRouter(
 async def get_business_type(
     page: int = Query(default=1, ge=1),
     limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=50),
+    after: Optional[PydanticObjectId] = Query(default=None, description="Keyset: lấy trang sau _id này"),
 ):
+    # Keyset theo _id giảm dần: trang sâu không tốn O(skip)
+    conditions = {"_id": {"$lt": after}} if after else {}
     data = await businessTypeService.find_many(
-        conditions={},
-        skip=(page - 1) * limit,
+        conditions=conditions,
+        skip=None if after else (page - 1) * limit,
         limit=limit,
+        sort=[("_id", -1)],
+        # Chỉ kéo các field response trả về
+        projection_model=BusinessTypeResponse,
     )
     return Response(data=data)
 
@@ -44,10 +50,12 @@ async def get_business_type(
     response_model=Response[BusinessTypeResponse],
     dependencies=[Depends(permission_required(permissions=["create.businesstype"]))],
 )
-async def post_business_type(data: BusinessTypeCreate | List[BusinessTypeCreate]):
-    import re
-
-    if await businessTypeService.find_one({"name": re.compile(f"^{re.escape(data.name)}$", re.IGNORECASE)}):
+async def post_business_type(data: BusinessTypeCreate):
+    # Equality + collation chạy trên unique index business_type_name_ci thay vì regex /i quét collection
+    if await businessTypeService.find_one(
+        {"name": data.name},
+        collation={"locale": "en", "strength": 2},
+    ):
         raise HTTP_409_CONFLICT(f"{data.name} đã tồn tại")
     data = await businessTypeService.insert(data)
     return Response(data=data)
@@ -71,10 +79,13 @@ async def update_business_type(id: PydanticObjectId, data: BusinessTypeUpdate):
     if await businessTypeService.find(id) is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy")
     if data.name:
-        if type := await businessTypeService.find_one({"name": {"$regex": f"^{data.name}$", "$options": "i"}}):
+        if type := await businessTypeService.find_one(
+            {"name": data.name},
+            collation={"locale": "en", "strength": 2},
+        ):
             if type.id != id:
                 raise HTTP_409_CONFLICT(f"Loại hình {data.name} đã tồn tại")
-    data = await businessTypeService.update(id=id, data=data.model_dump(exclude_none=True))
+    data = await businessTypeService.update(id=id, data=data)
     return Response(data=data)
 
 
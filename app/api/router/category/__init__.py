@@ -1,11 +1,13 @@
+import asyncio
 from typing import List, Optional
 
 from beanie import PydanticObjectId
 from fastapi import APIRouter, Depends, Query, Request
 
-from app.api.dependency import login_required, permission_required, role_required
+from app.api.dependency import get_current_business, login_required, permission_required, role_required
 from app.common.api_response import Response
 from app.common.http_exception import HTTP_404_NOT_FOUND, HTTP_409_CONFLICT
+from app.core.config import settings
 from app.db import Mongo
 from app.schema.category import (
     CategoryCreate,
@@ -16,7 +18,7 @@ from app.schema.category import (
     SubCategoryResponse,
     SubCategoryUpdate,
 )
-from app.service import businessService, categoryService, productService, subcategoryService
+from app.service import categoryService, productService, subcategoryService
 
 apiRouter = APIRouter(
     tags=["Category"],
@@ -42,9 +44,11 @@ apiRouter = APIRouter(
     response_model=Response[CategoryResponse],
     dependencies=[Depends(permission_required(permissions=["create.category"]))],
 )
-async def post_category(data: CategoryCreate, request: Request):
-    business = await businessService.find(request.state.user_scope)
-    if await categoryService.find_one(conditions={"name": data.name, "business.$id": business.id}):
+async def post_category(data: CategoryCreate, business=Depends(get_current_business)):
+    if await categoryService.find_one(
+        conditions={"business.$id": business.id, "name": data.name},
+        collation={"locale": "en", "strength": 2},
+    ):
         raise HTTP_409_CONFLICT(f"Phân loại {data.name} đã tồn tại")
     data = data.model_dump()
     data["business"] = business
@@ -59,9 +63,23 @@ async def post_category(data: CategoryCreate, request: Request):
     response_model=Response[List[CategoryResponse]],
     dependencies=[Depends(permission_required(permissions=["view.category"]))],
 )
-async def get_subcategory(request: Request):
+async def get_subcategory(
+    request: Request,
+    page: int = Query(default=1, ge=1),
+    limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=50),
+    after: Optional[PydanticObjectId] = Query(default=None, description="Keyset: lấy trang sau _id này"),
+):
+    conditions = {"business.$id": request.state.user_scope_oid}
+    if after:
+        # Keyset theo _id giảm dần: không tốn O(skip) khi lật trang sâu
+        conditions["_id"] = {"$lt": after}
     categories = await categoryService.find_many(
-        conditions={"business.$id": PydanticObjectId(request.state.user_scope)}
+        conditions=conditions,
+        skip=None if after else (page - 1) * limit,
+        limit=limit,
+        sort=[("_id", -1)],
+        # Chỉ kéo các field response trả về
+        projection_model=CategoryResponse,
     )
     return Response(data=categories)
 
@@ -73,22 +91,45 @@ async def get_subcategory(request: Request):
     response_model=Response[List[SubCategoryResponse]],
     dependencies=[Depends(permission_required(permissions=["view.subcategory"]))],
 )
-async def get_category(request: Request, category: Optional[PydanticObjectId] = Query(default=None)):
+async def get_category(
+    request: Request,
+    category: Optional[PydanticObjectId] = Query(default=None),
+    page: int = Query(default=1, ge=1),
+    limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=50),
+    after: Optional[PydanticObjectId] = Query(default=None, description="Keyset: lấy trang sau _id này"),
+):
+    conditions = (
+        {"category.$id": category} if category else {"business.$id": request.state.user_scope_oid}
+    )
+    if after:
+        conditions["_id"] = {"$lt": after}
+    # 1 aggregation join thẳng category, khỏi gom id rồi fetch_links từng link;
+    # phân trang trước $lookup để chỉ join số dòng trả về
+    pipeline = [
+        {"$match": conditions},
+        {"$sort": {"_id": -1}},
+        {"$skip": 0 if after else (page - 1) * limit},
+        {"$limit": limit},
+        {
+            "$lookup": {
+                "from": "Category",
+                "localField": "category.$id",
+                "foreignField": "_id",
+                "as": "category",
+            }
+        },
+        {"$unwind": "$category"},
+    ]
     if category:
-        category = await categoryService.find(category)
-        if category is None:
+        # Check tồn tại và aggregation độc lập nhau, chạy song song
+        existed, subcategories = await asyncio.gather(
+            categoryService.find(category),
+            subcategoryService.aggregate(pipeline),
+        )
+        if existed is None:
             raise HTTP_404_NOT_FOUND("Phân loại không phù hợp")
-        categories = [category]
     else:
-        categories = await categoryService.find_many(
-            conditions={"business.$id": PydanticObjectId(request.state.user_scope)}
-        )
-    subcategories = await subcategoryService.find_many(
-        conditions={
-            "category._id": {"$in": [cat.id for cat in categories]},
-        },
-        fetch_links=True,
-    )
+        subcategories = await subcategoryService.aggregate(pipeline)
     return Response(data=subcategories)
 
 
@@ -108,12 +149,12 @@ async def get_category(request: Request, category: Optional[PydanticObjectId] =
     ],
 )
 async def put_sub_category(id: PydanticObjectId, data: SubCategoryUpdate, request: Request):
-    sub_category = await subcategoryService.find(id)
+    # subcategory đã mang sẵn link business: check scope ngay trong find_one, khỏi fetch_link category
+    sub_category = await subcategoryService.find_one(
+        conditions={"_id": id, "business.$id": request.state.user_scope_oid},
+    )
     if sub_category is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy phân loại")
-    await sub_category.fetch_link("category")
-    if sub_category.category.business.id != PydanticObjectId(request.state.user_scope):
-        raise HTTP_404_NOT_FOUND("Không tìm thấy phân loại")
     subcat = await subcategoryService.update(id, data)
     await subcat.fetch_link("category")
     return Response(data=subcat)
@@ -130,7 +171,7 @@ async def view_category(id: PydanticObjectId, request: Request):
     category = await categoryService.find_one(
         conditions={
             "_id": id,
-            "business.$id": PydanticObjectId(request.state.user_scope),
+            "business.$id": request.state.user_scope_oid,
         },
     )
     if category is None:
@@ -164,7 +205,7 @@ async def put_category(id: PydanticObjectId, data: CategoryUpdate, request: Requ
     category = await categoryService.find_one(
         conditions={
             "_id": id,
-            "business.$id": PydanticObjectId(request.state.user_scope),
+            "business.$id": request.state.user_scope_oid,
         },
         projection_model=CategoryResponse,
     )
@@ -186,15 +227,18 @@ async def delete_category(id: PydanticObjectId, request: Request):
         category = await categoryService.find_one(
             conditions={
                 "_id": id,
-                "business.$id": PydanticObjectId(request.state.user_scope),
+                "business.$id": request.state.user_scope_oid,
             },
             session=session,
         )
         if category is None:
             raise HTTP_404_NOT_FOUND("Không tìm thấy phân loại")
-        await categoryService.delete(id)
-        await subcategoryService.delete_many(conditions={"category.$id": id})
-        await productService.delete_many(conditions={"category.$id": id})
+        # 3 lệnh xóa vốn không dùng session, chạy song song thay vì nối tiếp
+        await asyncio.gather(
+            categoryService.delete(id),
+            subcategoryService.delete_many(conditions={"category.$id": id}),
+            productService.delete_many(conditions={"category.$id": id}),
+        )
     return Response(data="Xóa thành công")
 
 
@@ -209,7 +253,7 @@ async def post_subcategory(id: PydanticObjectId, data: SubCategoryCreate, reques
     category = await categoryService.find_one(
         conditions={
             "_id": id,
-            "business.$id": PydanticObjectId(request.state.user_scope),
+            "business.$id": request.state.user_scope_oid,
         }
     )
     if category is None:
@@ -230,13 +274,12 @@ async def post_subcategory(id: PydanticObjectId, data: SubCategoryCreate, reques
 )
 async def delete_subcategory(id: PydanticObjectId, request: Request):
     async with subcategoryService.transaction(Mongo.client) as session:
-        sub_category = await subcategoryService.find(id, session=session)
+        sub_category = await subcategoryService.find_one(
+            conditions={"_id": id, "business.$id": request.state.user_scope_oid},
+            session=session,
+        )
         if sub_category is None:
             raise HTTP_404_NOT_FOUND("Không tìm thấy phân loại")
-        await sub_category.fetch_link("category")
-        category = sub_category.category
-        if category.business.id != PydanticObjectId(request.state.user_scope):
-            raise HTTP_404_NOT_FOUND("Không tìm thấy phân loại")
         await subcategoryService.delete(id)
         await productService.delete_many(conditions={"subcategory.$id": id})
     return Response(data="Xóa thành công")
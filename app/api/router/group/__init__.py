@@ -1,16 +1,17 @@
-from typing import List
+import asyncio
+from typing import List, Optional
 
 from beanie import PydanticObjectId
-from fastapi import APIRouter, Depends, Request
-from fastapi.encoders import jsonable_encoder
+from bson import DBRef
+from fastapi import APIRouter, Depends, Query, Request
 
-from app.api.dependency import login_required, permission_required, role_required
+from app.api.dependency import get_current_business, login_required, permission_required, role_required
 from app.common.api_message import KeyResponse, get_message
 from app.common.api_response import Response
 from app.common.http_exception import HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND, HTTP_409_CONFLICT
-from app.db import Mongo
+from app.core.config import settings
 from app.schema.group import FullGroupResponse, GroupCreate, GroupResponse
-from app.service import businessService, groupService, permissionService, userService
+from app.service import groupService, userService
 
 apiRouter = APIRouter(
     tags=["Group"],
@@ -34,9 +35,24 @@ apiRouter = APIRouter(
         ),
     ],
 )
-async def get_groups(request: Request):
+async def get_groups(
+    request: Request,
+    page: int = Query(default=1, ge=1),
+    limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=50),
+    after: Optional[PydanticObjectId] = Query(default=None, description="Keyset: lấy trang sau _id này"),
+):
+    conditions = {"business._id": request.state.user_scope_oid}
+    if after:
+        # Keyset theo _id giảm dần: không tốn O(skip) khi lật trang sâu
+        conditions["_id"] = {"$lt": after}
     groups = await groupService.find_many(
-        {"business._id": PydanticObjectId(request.state.user_scope)}, fetch_links=True
+        conditions,
+        skip=None if after else (page - 1) * limit,
+        limit=limit,
+        sort=[("_id", -1)],
+        fetch_links=True,
+        # Chỉ kéo các field response trả về (bỏ business đã join)
+        projection_model=GroupResponse,
     )
     return Response(data=groups)
 
@@ -56,10 +72,10 @@ async def get_groups(request: Request):
 )
 async def get_group(id: PydanticObjectId, request: Request):
     group = await groupService.find(id)
-    if PydanticObjectId(request.state.user_scope) == group.business.to_ref().id:
+    if request.state.user_scope_oid == group.business.to_ref().id:
         await group.fetch_link("permissions")
+        # users đã được type đúng trên FullGroupResponse, Pydantic tự serialize 1 lần
         data = await FullGroupResponse.from_model(group)
-        data.users = jsonable_encoder(data.users)
         return Response(data=data)
     raise HTTP_403_FORBIDDEN(get_message(KeyResponse.PERMISSION_DENIED))
 
@@ -76,12 +92,14 @@ async def get_group(id: PydanticObjectId, request: Request):
         ),
     ],
 )
-async def post_group(data: GroupCreate, request: Request):
+async def post_group(data: GroupCreate, request: Request, business=Depends(get_current_business)):
     data = data.model_dump()
-    business = await businessService.find(request.state.user_scope)
     data["business"] = business
-    group_in_business = await groupService.find_many({"business.$id": PydanticObjectId(request.state.user_scope)})
-    if any(group.name.lower() == data["name"].lower() for group in group_in_business):
+    # Equality + collation seek trên index thay vì tải cả danh sách nhóm rồi so lower() bằng Python
+    if await groupService.find_one(
+        conditions={"business.$id": request.state.user_scope_oid, "name": data["name"]},
+        collation={"locale": "en", "strength": 2},
+    ):
         raise HTTP_409_CONFLICT(f"Đã có nhóm {data["name"]} tại doanh nghiệp này")
     group = await groupService.insert(data)
     return Response(data=group)
@@ -100,33 +118,29 @@ async def post_group(data: GroupCreate, request: Request):
     response_model=Response[str],
 )
 async def delete_group(id: PydanticObjectId, request: Request):
-    async with groupService.transaction(Mongo.client) as session:
-        if (
-            await groupService.find_one(
-                conditions={
-                    "_id": id,
-                    "business.$id": PydanticObjectId(request.state.user_scope),
-                },
-                session=session,
-            )
-            is None
-        ):
-            raise HTTP_404_NOT_FOUND("Không tìm thấy nhóm")
-        await groupService.delete(
-            id,
-            session=session,
-        )
-        await userService.update_many(
+    if (
+        await groupService.find_one(
             conditions={
-                "group.$id": id,
+                "_id": id,
+                "business.$id": request.state.user_scope_oid,
             },
-            update_data={
-                "$pull": {
-                    "group": {"$id": id},
-                },
-            },
-            session=session,
         )
+        is None
+    ):
+        raise HTTP_404_NOT_FOUND("Không tìm thấy nhóm")
+    # Gỡ reference nhóm khỏi user là dọn dẹp best-effort, không cần transaction 2 collection
+    await groupService.delete(id)
+    await userService.update_many(
+        conditions={
+            "group.$id": id,
+        },
+        update_data={
+            "$pull": {
+                "group": {"$id": id},
+            },
+            "$inc": {"perms_version": 1},
+        },
+    )
     return Response(data="Xóa thành công")
 
 
@@ -147,29 +161,39 @@ async def give_permissions(
     request: Request,
     data: List[PydanticObjectId] | None = None,
 ):
+    data = data or []
+    # $all trên permissions.$id: server tự kiểm tra tập quyền cấp có nằm trong quyền đang giữ,
+    # khỏi tải danh sách permission rồi so từng phần tử bằng Python;
+    # 2 truy vấn đọc độc lập nhau nên chạy song song
+    if data:
+        group, allowed = await asyncio.gather(
+            groupService.find(id),
+            userService.find_one(
+                conditions={
+                    "_id": request.state.user_id_oid,
+                    "permissions.$id": {"$all": data},
+                },
+            ),
+        )
+    else:
+        group, allowed = await groupService.find(id), None
     # Check scope
-    group = await groupService.find(id)
-    if group is None:
-        raise HTTP_404_NOT_FOUND("Không tìm thấy")
-    user = await userService.find(request.state.user_id)
-    if user.business.to_ref().id != group.business.to_ref().id:
+    if group is None or request.state.user_scope_oid != group.business.to_ref().id:
         raise HTTP_404_NOT_FOUND("Không tìm thấy")
-    # Grant permission
-    data = data or []
-    grant_permissions = await permissionService.find_many(
-        conditions={
-            "_id": {
-                "$in": data,
-            }
+    if data and allowed is None:
+        raise HTTP_403_FORBIDDEN("Cần có quyền để cấp")
+    group = await groupService.update(
+        id=id,
+        data={
+            "permissions": [DBRef("Permission", permission_id) for permission_id in data],
+            "perms_version": group.perms_version + 1,
         },
     )
-    grant_permission_ids = [p.id for p in grant_permissions]
-    # User permission
-    user_permissions = [permission.to_ref().id for permission in user.permissions]
-    # Check
-    if any(permission not in user_permissions for permission in grant_permission_ids):
-        raise HTTP_403_FORBIDDEN("Cần có quyền để cấp")
-    group = await groupService.update(id=id, data={"permissions": grant_permissions})
+    # Vô hiệu cache quyền của các thành viên trong nhóm
+    await userService.update_many(
+        conditions={"group.$id": id},
+        update_data={"$inc": {"perms_version": 1}},
+    )
     await group.fetch_link("permissions")
     return Response(data=group)
 
@@ -191,17 +215,11 @@ async def delete_permissions(id: PydanticObjectId, request: Request, data: List[
     group = await groupService.find(id)
     if group is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy")
-    user = await userService.find(request.state.user_id)
-    if user.business.to_ref().id != group.business.to_ref().id:
+    if request.state.user_scope_oid != group.business.to_ref().id:
         raise HTTP_403_FORBIDDEN("Bạn không đủ quyền thực hiện hành động này")
-    # Grant permission
+    # Revoke permission: $pull theo DBRef dựng từ id, khỏi hydrate permission document
     data = data or []
-    grant_permissions = await permissionService.find_many(
-        conditions={
-            "_id": {"$in": data},
-        },
-    )
-    if not grant_permissions:
+    if not data:
         await group.fetch_link("permissions")
         return Response(data=group)
     group = await groupService.update_one(
@@ -209,11 +227,17 @@ async def delete_permissions(id: PydanticObjectId, request: Request, data: List[
         conditions={
             "$pull": {
                 "permissions": {
-                    "$in": [p.to_ref() for p in grant_permissions],
+                    "$in": [DBRef("Permission", permission_id) for permission_id in data],
                 },
             },
+            "$inc": {"perms_version": 1},
         },
     )
+    # Vô hiệu cache quyền của các thành viên trong nhóm
+    await userService.update_many(
+        conditions={"group.$id": id},
+        update_data={"$inc": {"perms_version": 1}},
+    )
     await group.fetch_link("permissions")
     return Response(data=group)
 
@@ -231,29 +255,26 @@ async def delete_permissions(id: PydanticObjectId, request: Request, data: List[
         ),
     ],
 )
-async def add_to_group(id: PydanticObjectId, user_id: PydanticObjectId | str, request: Request):
+async def add_to_group(id: PydanticObjectId, user_id: str, request: Request):
     group = await groupService.find(id)
     if group is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy nhóm")
     group_scope = group.business.to_ref().id
-    current_scope = PydanticObjectId(request.state.user_scope)
+    current_scope = request.state.user_scope_oid
     if current_scope != group_scope:
         raise HTTP_403_FORBIDDEN("Bạn không đủ quyền thực hiện hành động này")
-    conditions = {
-        "$or": [
-            {"_id": user_id},
-            {"username": user_id},
-        ],
-    }
-    if not PydanticObjectId.is_valid(user_id):
-        conditions["$or"] = conditions.get("$or")[1:]
-    user = await userService.find_one(conditions)
-    if user is None:
+    # 1 seek theo index (_id hoặc username) thay vì $or 2 nhánh; gộp luôn scope vào điều kiện
+    if PydanticObjectId.is_valid(user_id):
+        conditions = {"_id": PydanticObjectId(user_id), "business.$id": current_scope}
+    else:
+        conditions = {"username": user_id, "business.$id": current_scope}
+    # update_where tự xác nhận user tồn tại trong scope qua matched_count, khỏi find_one trước
+    matched = await userService.update_where(
+        conditions=conditions,
+        update_data={"$addToSet": {"group": group.to_ref()}, "$inc": {"perms_version": 1}},
+    )
+    if not matched:
         raise HTTP_404_NOT_FOUND("Không tìm thấy người dùng")
-    user_scope = user.business.to_ref().id
-    if current_scope != user_scope:
-        raise HTTP_403_FORBIDDEN("Bạn không đủ quyền thực hiện hành động này")
-    await userService.update_one(id=user.id, conditions={"$addToSet": {"group": group.to_ref()}})
     return Response(data=True)
 
 
@@ -268,34 +289,29 @@ async def add_to_group(id: PydanticObjectId, user_id: PydanticObjectId | str, re
         ),
     ],
 )
-async def delete_to_group(id: PydanticObjectId, user_id: PydanticObjectId | str, request: Request):
+async def delete_to_group(id: PydanticObjectId, user_id: str, request: Request):
     group = await groupService.find(id)
     if group is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy nhóm")
     group_scope = group.business.to_ref().id
-    current_scope = PydanticObjectId(request.state.user_scope)
+    current_scope = request.state.user_scope_oid
     if current_scope != group_scope:
         raise HTTP_403_FORBIDDEN("Bạn không đủ quyền thực hiện hành động này")
-    conditions = {
-        "$or": [
-            {"_id": user_id},
-            {"username": user_id},
-        ],
-    }
-    if not PydanticObjectId.is_valid(user_id):
-        conditions["$or"] = conditions.get("$or")[1:]
-    user = await userService.find_one(conditions)
-    if user is None:
-        raise HTTP_404_NOT_FOUND("Không tìm thấy người dùng")
-    user_scope = user.business.to_ref().id
-    if current_scope != user_scope:
-        raise HTTP_403_FORBIDDEN("Bạn không đủ quyền thực hiện hành động này")
-    await userService.update_one(
-        id=user.id,
-        conditions={
+    # 1 seek theo index (_id hoặc username) thay vì $or 2 nhánh; gộp luôn scope vào điều kiện
+    if PydanticObjectId.is_valid(user_id):
+        conditions = {"_id": PydanticObjectId(user_id), "business.$id": current_scope}
+    else:
+        conditions = {"username": user_id, "business.$id": current_scope}
+    # update_where tự xác nhận user tồn tại trong scope qua matched_count, khỏi find_one trước
+    matched = await userService.update_where(
+        conditions=conditions,
+        update_data={
             "$pull": {
                 "group": group.to_ref(),
             },
+            "$inc": {"perms_version": 1},
         },
     )
+    if not matched:
+        raise HTTP_404_NOT_FOUND("Không tìm thấy người dùng")
     return Response(data=True)
@@ -1,12 +1,12 @@
+import asyncio
 from datetime import datetime, timedelta
 from typing import List, Literal, Optional
 
-import httpx
-from beanie import Link, PydanticObjectId
+from beanie import PydanticObjectId
 from fastapi import APIRouter, Depends, Query, Request
 from jwt.exceptions import ExpiredSignatureError
 
-from app.api.dependency import login_required, permission_required, role_required
+from app.api.dependency import get_http, login_required, permission_required, role_required
 from app.common.api_response import Response
 from app.common.http_exception import (
     HTTP_400_BAD_REQUEST,
@@ -16,18 +16,15 @@ from app.common.http_exception import (
 from app.core.config import settings
 from app.core.security import ACCESS_JWT
 from app.db import Mongo
-from app.schema.area import AreaResponse
-from app.schema.branch import BranchResponse
 from app.schema.order import (
     CheckoutOrder,
     MinimumOrderResponse,
     OrderResponse,
     OrderStatus,
-    OrderUpdate,
     PaymentMethod,
     Report,
 )
-from app.schema.service_unit import ServiceUnitResponse
+from app.schema.product import ProductResponse
 from app.service import orderService, paymentService, productService
 
 apiRouter = APIRouter(
@@ -47,6 +44,24 @@ apiRouter = APIRouter(
 )
 
 
+async def _attach_products(orders) -> None:
+    # Gom id sản phẩm của mọi đơn rồi fetch 1 lần bằng $in, thay vì N+1 find theo từng item
+    # (nhận cả document lẫn dict thô từ aggregation)
+    items_lists = [order["items"] if isinstance(order, dict) else order.items for order in orders]
+    product_ids = {item.get("product").id for items in items_lists for item in items}
+    if not product_ids:
+        return
+    # Chỉ kéo các field client dùng (bỏ link category/business) để giảm bytes + chi phí decode
+    products = await productService.find_many(
+        conditions={"_id": {"$in": list(product_ids)}},
+        projection_model=ProductResponse,
+    )
+    product_map = {product.id: product for product in products}
+    for items in items_lists:
+        for item in items:
+            item["product"] = product_map.get(str(item.get("product").id))
+
+
 @apiRouter.get(
     path="/report",
     response_model=Response[Report],
@@ -73,19 +88,19 @@ async def report(
     if request.state.user_role != "BusinessOwner":
         raise HTTP_403_FORBIDDEN("Bạn không đủ quyền thực hiện hành động này")
     conditions = {
-        "business._id": PydanticObjectId(request.state.user_scope),
+        "business.$id": request.state.user_scope_oid,
         "status": OrderStatus.PAID,
     }
     if branch:
-        conditions["branch._id"] = branch
+        conditions["branch.$id"] = branch
     if area:
-        conditions["area._id"] = area
+        conditions["area.$id"] = area
     if service_unit:
-        conditions["service_unit._id"] = service_unit
+        conditions["service_unit.$id"] = service_unit
     if method:
         conditions["payment_method"] = method
     if staff:
-        conditions["staff"] = staff
+        conditions["staff.$id"] = staff
     if product:
         conditions["items.product.$id"] = product
     if start_date and end_date:
@@ -94,42 +109,9 @@ async def report(
         conditions["created_at"] = {"$gte": start_date}
     elif end_date:
         conditions["created_at"] = {"$lte": end_date}
-    orders = await orderService.find_many(
-        conditions,
-        fetch_links=True,
-    )
-    for order in orders:
-        for item in order.items:
-            product = await productService.find(item.get("product").id)
-            item["product"] = product
-    for order in orders:
-        if isinstance(order.service_unit, Link):
-            order.service_unit = ServiceUnitResponse(id=order.service_unit.to_dict().get("id"), name="Không xác định")
-        if isinstance(order.area, Link):
-            order.area = AreaResponse(
-                id=order.area.to_dict().get("id"),
-                name="Không xác định",
-                branch=(
-                    BranchResponse(
-                        id=order.branch.to_dict().get("id"),
-                        name="Không xác định",
-                        address="Không xác định",
-                    )
-                    if isinstance(order.branch, Link)
-                    else order.branch
-                ),
-            )
-        if isinstance(order.branch, Link):
-            order.branch = BranchResponse(
-                id=order.branch.to_dict().get("id"), name="Không xác định", address="Không xác định"
-            )
-    return Response(
-        data=Report(
-            orders=orders,
-            total_amount=sum([order.amount for order in orders]),
-            total_count=len(orders),
-        ),
-    )
+    data = await orderService.report(conditions)
+    await _attach_products(data["orders"])
+    return Response(data=Report(**data))
 
 
 @apiRouter.get(
@@ -155,52 +137,27 @@ async def get_orders(
     limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=50),
 ):
     conditions = {
-        "business._id": PydanticObjectId(request.state.user_scope),
+        "business.$id": request.state.user_scope_oid,
     }
     if request.state.user_branch:
-        conditions["branch._id"] = PydanticObjectId(request.state.user_branch)
+        conditions["branch.$id"] = request.state.user_branch_oid
     else:
         if branch:
-            conditions["branch._id"] = branch
+            conditions["branch.$id"] = branch
     if area:
-        conditions["area._id"] = area
+        conditions["area.$id"] = area
     if service_unit:
-        conditions["service_unit._id"] = service_unit
+        conditions["service_unit.$id"] = service_unit
     if status:
         conditions["status"] = status
     if method:
         conditions["payment_method"] = method
-    orders = await orderService.find_many(
+    orders = await orderService.find_many_with_relations(
         conditions,
-        fetch_links=True,
         skip=(page - 1) * limit,
         limit=limit,
     )
-    for order in orders:
-        for item in order.items:
-            product = await productService.find(item.get("product").id)
-            item["product"] = product
-    for order in orders:
-        if isinstance(order.service_unit, Link):
-            order.service_unit = ServiceUnitResponse(id=order.service_unit.to_dict().get("id"), name="Không xác định")
-        if isinstance(order.area, Link):
-            order.area = AreaResponse(
-                id=order.area.to_dict().get("id"),
-                name="Không xác định",
-                branch=(
-                    BranchResponse(
-                        id=order.branch.to_dict().get("id"),
-                        name="Không xác định",
-                        address="Không xác định",
-                    )
-                    if isinstance(order.branch, Link)
-                    else order.branch
-                ),
-            )
-        if isinstance(order.branch, Link):
-            order.branch = BranchResponse(
-                id=order.branch.to_dict().get("id"), name="Không xác định", address="Không xác định"
-            )
+    await _attach_products(orders)
     return Response(data=orders)
 
 
@@ -222,38 +179,38 @@ async def view_checkout(
     template: Literal["compact2", "compact", "qr_only", "print"] = Query(
         default="compact", description="Kiểu template QR cần xuất"
     ),
+    client=Depends(get_http),
 ):
     try:
         payload = ACCESS_JWT.decode(token)
         if request.state.user_scope != payload.get("business"):
             raise HTTP_404_NOT_FOUND("Không tìm thấy đơn hàng")
         orders = [PydanticObjectId(order) for order in payload.get("orders")]
-        orders = await orderService.find_many(
-            conditions={"_id": {"$in": orders}},
-            projection_model=MinimumOrderResponse,
+        # 2 truy vấn độc lập nhau, chạy song song
+        orders, payment = await asyncio.gather(
+            orderService.find_many(
+                conditions={"_id": {"$in": orders}},
+                projection_model=MinimumOrderResponse,
+            ),
+            paymentService.find_one(
+                conditions={
+                    "business.$id": request.state.user_scope_oid,
+                },
+            ),
         )
-        for order in orders:
-            for item in order.items:
-                item["product"] = str(item["product"].id)
-        payment = await paymentService.find_one(
-            conditions={
-                "business.$id": PydanticObjectId(request.state.user_scope),
+        response = await client.post(
+            url="/v2/generate",
+            json={
+                "accountNo": payment.accountNo,
+                "accountName": payment.accountName,
+                "acqId": payment.acqId,
+                "amount": orders[-1].amount,
+                "addInfo": "Thanh toán đơn hàng",
+                "format": "text",
+                "template": template,
             },
         )
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url="https://api.vietqr.io/v2/generate",
-                json={
-                    "accountNo": payment.accountNo,
-                    "accountName": payment.accountName,
-                    "acqId": payment.acqId,
-                    "amount": order.amount,
-                    "addInfo": "Thanh toán đơn hàng",
-                    "format": "text",
-                    "template": template,
-                },
-            )
-            qr_code = response.json().get("data").get("qrDataURL")
+        qr_code = response.json().get("data").get("qrDataURL")
         data = CheckoutOrder(
             qr_code=qr_code,
             orders=orders,
@@ -279,15 +236,13 @@ async def get_order(
     request: Request,
 ):
     conditions = {
-        "business._id": PydanticObjectId(request.state.user_scope),
+        "business._id": request.state.user_scope_oid,
         "_id": id,
     }
     order = await orderService.find_one(conditions, fetch_links=True)
     if order is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy đơn hàng")
-    for item in order.items:
-        product = await productService.find(item.get("product").id)
-        item["product"] = product
+    await _attach_products([order])
     return Response(data=order)
 
 
@@ -315,16 +270,21 @@ async def post_orders(
         payload = ACCESS_JWT.decode(token)
         if request.state.user_scope != payload.get("business"):
             raise HTTP_404_NOT_FOUND("Không tìm thấy đơn hàng")
+        # Convert id 1 lần ngoài truy vấn
+        oids = [PydanticObjectId(oid) for oid in payload.get("orders")]
         async with orderService.transaction(Mongo.client) as session:
-            for oid in payload.get("orders"):
-                await orderService.update(
-                    id=PydanticObjectId(oid),
-                    data=OrderUpdate(
-                        status=OrderStatus.PAID,
-                        payment_method=method,
-                    ),
-                    session=session,
-                )
+            # 1 update_many cho cả lô thay vì update từng đơn nối tiếp trong transaction
+            await orderService.update_many(
+                conditions={"_id": {"$in": oids}},
+                update_data={
+                    "$set": {
+                        "status": OrderStatus.PAID,
+                        "payment_method": method,
+                        "updated_at": datetime.now(),
+                    },
+                },
+                session=session,
+            )
         return Response(data="Đơn hàng đã được xử lí")
     except ExpiredSignatureError as e:
         raise HTTP_400_BAD_REQUEST("Liên kết thanh toán đã hết hạn. Vui lòng tạo lại phiên thanh toán mới.") from e
@@ -346,17 +306,21 @@ async def gen_qr_for_orders(
     request: Request,
     orders: List[PydanticObjectId],
 ):
-    orders = await orderService.find_many(
-        conditions={
-            "_id": {"$in": orders},
-            "business.$id": PydanticObjectId(request.state.user_scope),
-            "status": OrderStatus.UNPAID,
-        }
-    )
-    if not orders:
+    # Duyệt cursor và chỉ giữ lại id: không materialize cả lô document vào RAM
+    order_ids = [
+        str(order.id)
+        async for order in orderService.iter_many(
+            conditions={
+                "_id": {"$in": orders},
+                "business.$id": request.state.user_scope_oid,
+                "status": OrderStatus.UNPAID,
+            }
+        )
+    ]
+    if not order_ids:
         raise HTTP_404_NOT_FOUND("Không tìm thấy đơn hàng")
     payload = {
-        "orders": [str(order.id) for order in orders],
+        "orders": order_ids,
         "business": request.state.user_scope,
         "branch": request.state.user_branch,
         "action": "checkout",
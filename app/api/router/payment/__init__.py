@@ -1,15 +1,16 @@
-import httpx
-from beanie import PydanticObjectId
+import asyncio
+import time
+
+from bson import DBRef
 from fastapi import APIRouter, Depends, Request
 
-from app.api.dependency import login_required, role_required
+from app.api.dependency import get_http, login_required, role_required
 from app.common.api_response import Response
 from app.common.http_exception import HTTP_400_BAD_REQUEST
 from app.core.decorator import limiter
-from app.db import Mongo
 from app.schema.order import PaymentMethod
 from app.schema.payment import PaymentCreate, PaymentResponse
-from app.service import paymentService, userService
+from app.service import paymentService
 
 apiRouter = APIRouter(
     tags=["Payment"],
@@ -25,20 +26,37 @@ apiRouter = APIRouter(
 )
 
 
+# Danh sách ngân hàng hiếm khi đổi: cache 1 giờ, lock chống dồn request khi cache hết hạn
+_BANKS_TTL = 3600
+_banks_cache: tuple = (0.0, None)  # (hạn cache, data)
+_banks_lock = asyncio.Lock()
+
+# Danh sách phương thức là hằng, dựng cả Response 1 lần lúc import
+_PAYMENT_METHODS = Response(
+    data=[{"name": method.name, "description": method.description()} for method in PaymentMethod]
+)
+
+
 @apiRouter.get(path="/banks", name="Danh sách ngân hàng", response_model=Response)
 @limiter(duration=120)
-async def get_banks(request: Request):
-    async with httpx.AsyncClient() as client:
-        response = await client.get("https://api.vietqr.io/v2/banks")
-        data = response.json().get("data")
+async def get_banks(request: Request, client=Depends(get_http)):
+    global _banks_cache
+    expires_at, data = _banks_cache
+    if data is not None and expires_at > time.monotonic():
         return Response(data=data)
+    async with _banks_lock:
+        expires_at, data = _banks_cache
+        if data is not None and expires_at > time.monotonic():
+            return Response(data=data)
+        response = await client.get("/v2/banks")
+        data = response.json().get("data")
+        _banks_cache = (time.monotonic() + _BANKS_TTL, data)
+    return Response(data=data)
 
 
 @apiRouter.get(path="/methods", name="Xem phương thức thanh toán", response_model=Response)
 async def get_method():
-    return Response(
-        data=[{"name": method.name, "description": method.description()} for method in PaymentMethod],
-    )
+    return _PAYMENT_METHODS
 
 
 @apiRouter.get(
@@ -49,7 +67,7 @@ async def get_method():
 async def get_my_bank(request: Request):
     payment = await paymentService.find_one(
         conditions={
-            "business.$id": PydanticObjectId(request.state.user_scope) if request.state.user_role != "Admin" else None
+            "business.$id": request.state.user_scope_oid if request.state.user_role != "Admin" else None
         }
     )
     return Response(data=payment)
@@ -62,27 +80,16 @@ async def get_my_bank(request: Request):
     response_model=Response[PaymentResponse],
 )
 async def post_banks(data: PaymentCreate, request: Request):
-    async with userService.transaction(Mongo.client) as session:
-        business = PydanticObjectId(request.state.user_scope) if request.state.user_role != "Admin" else None
-        payment = await paymentService.find_one(
-            conditions={
-                "business.$id": business,
-            },
-            session=session,
-        )
-        if payment:
-            await paymentService.delete(id=payment.id, session=session)
-        user = await userService.find(
-            id=request.state.user_id,
-            session=session,
-        )
-        data_dict = data.model_dump(by_alias=False)
-        data_dict["business"] = user.business.to_ref() if user.business else None
-        payment = await paymentService.insert(
-            data_dict,
-            session=session,
-        )
-        return Response(data=payment)
+    business = request.state.user_scope_oid if request.state.user_role != "Admin" else None
+    data_dict = data.model_dump(by_alias=False)
+    # Scope đã nằm trong token: dựng thẳng DBRef, khỏi fetch lại user
+    data_dict["business"] = DBRef("Business", business) if business else None
+    # 1 find_one_and_replace upsert (tự atomic) thay cho find_one + delete + insert trong transaction
+    payment = await paymentService.upsert(
+        conditions={"business.$id": business},
+        data=data_dict,
+    )
+    return Response(data=payment)
 
 
 @apiRouter.delete(
@@ -94,7 +101,7 @@ async def post_banks(data: PaymentCreate, request: Request):
 async def delete_my_bank(request: Request):
     payment = await paymentService.find_one(
         conditions={
-            "business.$id": PydanticObjectId(request.state.user_scope) if request.state.user_role != "Admin" else None
+            "business.$id": request.state.user_scope_oid if request.state.user_role != "Admin" else None
         }
     )
     if payment is None:
@@ -1,5 +1,6 @@
 from beanie import PydanticObjectId
 from fastapi import APIRouter, Depends
+from pymongo.errors import DuplicateKeyError
 
 from app.api.dependency import login_required, role_required
 from app.common.api_response import Response
@@ -27,9 +28,12 @@ async def post_plan(data: PlanCreate):
     payment = await paymentService.find_one(conditions={"business.$id": None})
     if payment is None:
         raise HTTP_400_BAD_REQUEST("Không tìm thấy thông tin thanh toán")
-    if await planService.find_one({"$or": [{"name": data.name}, {"period": data.period}]}):
-        raise HTTP_409_CONFLICT("Gói đã tồn tại")
-    plan = await planService.insert(data)
+    # Unique index trên name/period đã chặn trùng: ghi thẳng rồi bắt DuplicateKeyError,
+    # bỏ find_one pre-check vừa tốn round-trip vừa race khi ghi đồng thời
+    try:
+        plan = await planService.insert(data)
+    except DuplicateKeyError as e:
+        raise HTTP_409_CONFLICT("Gói đã tồn tại") from e
     return Response(data=plan)
 
 
@@ -39,14 +43,13 @@ async def post_plan(data: PlanCreate):
     name="Chỉnh sửa gói gia hạn",
 )
 async def put_plan(id: PydanticObjectId, data: PlanUpdate):
-    plan = await planService.find(id)
+    # 1 find_one_and_update: unique index báo trùng, kết quả None báo không tồn tại
+    try:
+        plan = await planService.update(id, data)
+    except DuplicateKeyError as e:
+        raise HTTP_409_CONFLICT("Gói đã tồn tại") from e
     if plan is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy gói")
-    if await planService.find_one(
-        {"$and": [{"_id": {"$ne": id}}, {"$or": [{"name": data.name}, {"period": data.period}]}]}
-    ):  # loại trừ chính nó
-        raise HTTP_409_CONFLICT("Gói đã tồn tại")
-    plan = await planService.update(id, data)
     return Response(data=plan)
 
 
@@ -1,37 +1,49 @@
+import asyncio
+import time
 import uuid
 from typing import List, Optional
 
-import httpx
 from beanie import PydanticObjectId
 from fastapi import APIRouter, Depends, File, Query, Request, UploadFile
 
-from app.api.dependency import login_required, permission_required, role_required
-from app.common.api_response import Response
+from app.api.dependency import get_http, login_required, permission_required, role_required
+from app.common.api_response import OK_DELETED, OK_TRUE, Response
 from app.common.http_exception import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_409_CONFLICT
+from app.common.utils import sniff_image_type
 from app.core.config import settings
 from app.db import Mongo, QRCode
+from app.models import Category, Product, SubCategory
 from app.schema.category import CategoryResponse, SubCategoryResponse
 from app.schema.plan import PlanResponse
 from app.schema.product import FullProductResponse, Menu, ProductCreate, ProductResponse, ProductUpdate
-from app.schema.user import UserResponse
+from app.schema.user import PublicUserResponse
 from app.service import categoryService, paymentService, planService, productService, subcategoryService, userService
 
 public_apiRouter = APIRouter(tags=["Resource Public"])
 
+# QR của gói gia hạn đổi rất chậm so với tần suất client gọi: cache TTL ngắn,
+# key theo bộ id gói để tự vỡ cache khi admin thêm/xóa gói; lock chống dồn
+# fan-out vietqr khi cache hết hạn (cùng pattern cache /payment/banks)
+_PLANS_TTL = 30
+_plans_cache: tuple = (0.0, None, None)  # (hạn cache, bộ id gói, data)
+_plans_lock = asyncio.Lock()
+
 
 @public_apiRouter.get(
     path="/accounts/{email}",
-    response_model=Response[List[UserResponse]],
+    response_model=Response[List[PublicUserResponse]],
     name="Danh sách tài khoản",
 )
 async def find_account_by_email(email: str):
+    # Projection trả thẳng schema công khai (không có branch): Mongo chỉ gửi các
+    # field cần thiết và validate đúng 1 lần ở tầng response
     accounts = await userService.find_many(
         conditions={
             "email": email,
             "email_verified": True,
         },
+        projection_model=PublicUserResponse,
     )
-    accounts = [UserResponse.model_validate(account).model_dump(exclude={"branch"}) for account in accounts]
     return Response(data=accounts)
 
 
@@ -40,30 +52,39 @@ async def find_account_by_email(email: str):
     response_model=Response[List[PlanResponse]],
     name="Danh sách gói gia hạn",
 )
-async def get_plans():
-    payment = await paymentService.find_one({"business.$id": None})
-    if payment is None:
-        raise HTTP_400_BAD_REQUEST("Hiện tại thanh toán không khả dụng")
+async def get_plans(client=Depends(get_http)):
+    global _plans_cache
     plans = await planService.find_many()
-    async with httpx.AsyncClient() as client:
-        data = []
-        for plan in plans:
-            response = await client.post(
-                url="https://api.vietqr.io/v2/generate",
-                json={
-                    "accountNo": payment.accountNo,
-                    "accountName": payment.accountName,
-                    "acqId": payment.acqId,
-                    "amount": plan.price,
-                    "addInfo": f"Thanh toán đơn hàng {uuid.uuid4()}",
-                    "format": "text",
-                    "template": "template",
-                },
-            )
-            plan = plan.model_dump()
-            plan["qr_code"] = response.json().get("data").get("qrDataURL")
-            data.append(plan)
+    plan_ids = frozenset(plan.id for plan in plans)
+    expires_at, cached_ids, data = _plans_cache
+    if data is not None and cached_ids == plan_ids and expires_at > time.monotonic():
         return Response(data=data)
+    async with _plans_lock:
+        expires_at, cached_ids, data = _plans_cache
+        if data is not None and cached_ids == plan_ids and expires_at > time.monotonic():
+            return Response(data=data)
+        payment = await paymentService.find_one({"business.$id": None})
+        if payment is None:
+            raise HTTP_400_BAD_REQUEST("Hiện tại thanh toán không khả dụng")
+        # Phần payload chung dựng 1 lần; bắn N request vietqr song song trên client pool
+        # dùng chung thay vì chờ nối tiếp từng gói
+        base_payload = {
+            "accountNo": payment.accountNo,
+            "accountName": payment.accountName,
+            "acqId": payment.acqId,
+            "format": "text",
+            "template": "template",
+        }
+        payloads = [
+            {**base_payload, "amount": plan.price, "addInfo": f"Thanh toán đơn hàng {uuid.uuid4()}"} for plan in plans
+        ]
+        responses = await asyncio.gather(*(client.post(url="/v2/generate", json=payload) for payload in payloads))
+        data = [
+            {**plan.model_dump(), "qr_code": response.json().get("data").get("qrDataURL")}
+            for plan, response in zip(plans, responses)
+        ]
+        _plans_cache = (time.monotonic() + _PLANS_TTL, plan_ids, data)
+    return Response(data=data)
 
 
 @public_apiRouter.get(
@@ -77,13 +98,24 @@ async def get_products(
     sub_category: Optional[PydanticObjectId] = Query(default=None),
     page: int = Query(default=1, ge=1),
     limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=50),
+    after: Optional[PydanticObjectId] = Query(default=None, description="Keyset: lấy trang sau _id này"),
 ):
-    conditions = {"business._id": business}
+    conditions = {"business.$id": business}
     if category:
-        conditions["category._id"] = category
+        conditions["category.$id"] = category
     if sub_category:
-        conditions["subcategory._id"] = sub_category
-    products = await productService.find_many(conditions, skip=(page - 1) * limit, limit=limit, fetch_links=True)
+        conditions["subcategory.$id"] = sub_category
+    if after:
+        # Keyset theo _id giảm dần: không tốn O(skip) khi lật trang sâu
+        conditions["_id"] = {"$lt": after}
+    # Join category/subcategory server-side trong 1 aggregation thay cho
+    # fetch_links (1 query phụ mỗi Link mỗi sản phẩm)
+    products = await productService.find_many_joined(
+        conditions,
+        skip=None if after else (page - 1) * limit,
+        limit=limit,
+        sort=[("_id", -1)],
+    )
     return Response(data=products)
 
 
@@ -96,12 +128,17 @@ async def get_categories(
     business: PydanticObjectId,
     page: int = Query(default=1, ge=1),
     limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=50),
+    after: Optional[PydanticObjectId] = Query(default=None, description="Keyset: lấy trang sau _id này"),
 ):
     conditions = {"business.$id": business}
+    if after:
+        # Keyset theo _id giảm dần: không tốn O(skip) khi lật trang sâu
+        conditions["_id"] = {"$lt": after}
     categories = await categoryService.find_many(
         conditions=conditions,
-        skip=(page - 1) * limit,
+        skip=None if after else (page - 1) * limit,
         limit=limit,
+        sort=[("_id", -1)],
         projection_model=CategoryResponse,
     )
     return Response(data=categories)
@@ -116,12 +153,30 @@ async def get_subcategories(
     business: PydanticObjectId,
     page: int = Query(default=1, ge=1),
     limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=50),
+    after: Optional[PydanticObjectId] = Query(default=None, description="Keyset: lấy trang sau _id này"),
 ):
-    categories = await categoryService.find_many({"business.$id": business})
-    conditions = {"category._id": {"$in": [category.id for category in categories]}}
-    sub_categories = await subcategoryService.find_many(
-        conditions=conditions, skip=(page - 1) * limit, limit=limit, fetch_links=True
-    )
+    conditions = {"business.$id": business}
+    if after:
+        # Keyset theo _id giảm dần: không tốn O(skip) khi lật trang sâu
+        conditions["_id"] = {"$lt": after}
+    # 1 aggregation: match thẳng business (SubCategory mang sẵn link) + $lookup category,
+    # bỏ bước tải danh mục rồi gom id vào $in; phân trang trước $lookup để chỉ join số dòng trả về
+    pipeline = [
+        {"$match": conditions},
+        {"$sort": {"_id": -1}},
+        {"$skip": 0 if after else (page - 1) * limit},
+        {"$limit": limit},
+        {
+            "$lookup": {
+                "from": "Category",
+                "localField": "category.$id",
+                "foreignField": "_id",
+                "as": "category",
+            }
+        },
+        {"$unwind": "$category"},
+    ]
+    sub_categories = await subcategoryService.aggregate(pipeline)
     return Response(data=sub_categories)
 
 
@@ -151,12 +206,13 @@ async def get_product(
     category: Optional[PydanticObjectId] = Query(default=None),
     sub_category: Optional[PydanticObjectId] = Query(default=None),
 ):
-    conditions = {"business._id": PydanticObjectId(request.state.user_scope)}
+    conditions = {"business.$id": request.state.user_scope_oid}
     if category:
-        conditions["category._id"] = category
+        conditions["category.$id"] = category
     if sub_category:
-        conditions["subcategory._id"] = sub_category
-    products = await productService.find_many(conditions, fetch_links=True)
+        conditions["subcategory.$id"] = sub_category
+    # Join category/subcategory server-side trong 1 aggregation thay cho fetch_links
+    products = await productService.find_many_joined(conditions)
     return Response(data=products)
 
 
@@ -174,35 +230,53 @@ async def get_product(
     ],
 )
 async def load_menu(menu: Menu, request: Request):
-    from app.models import Category, Product, SubCategory
-
-    business_id = PydanticObjectId(request.state.user_scope)
+    business_id = request.state.user_scope_oid
+    if not menu.categories:
+        return OK_TRUE
+    # Phẳng hóa menu lồng nhau thành 3 lô ghi: 1 insert_many cho toàn bộ danh mục,
+    # 1 cho toàn bộ phân loại, 1 cho toàn bộ sản phẩm — round-trip không còn
+    # tỉ lệ theo số danh mục
     async with productService.transaction(Mongo.client) as session:
-        for cat in menu.categories:
-            category_doc = await Category(
-                name=cat.name,
-                description=cat.description,
-                business=business_id,
-            ).insert(session=session)
+        cat_result = await Category.insert_many(
+            [
+                Category(name=cat.name, description=cat.description, business=business_id)
+                for cat in menu.categories
+            ],
+            session=session,
+        )
+        subcategories = []
+        sub_sources = []
+        for cat, category_id in zip(menu.categories, cat_result.inserted_ids):
             for sub in cat.subcategories:
-                subcategory_doc = await SubCategory(
-                    name=sub.name,
-                    description=sub.description,
-                    category=category_doc.id,
-                    business=business_id,
-                ).insert(session=session)
-                for prod in sub.products:
-                    await Product(
-                        name=prod.name,
-                        description=prod.description,
-                        variants=prod.variants,
-                        options=prod.options,
-                        img_url=prod.img_url,
-                        category=category_doc.id,
-                        subcategory=subcategory_doc.id,
+                subcategories.append(
+                    SubCategory(
+                        name=sub.name,
+                        description=sub.description,
+                        category=category_id,
                         business=business_id,
-                    ).insert(session=session)
-    return Response(data=True)
+                    )
+                )
+                sub_sources.append((sub, category_id))
+        if not subcategories:
+            return OK_TRUE
+        sub_result = await SubCategory.insert_many(subcategories, session=session)
+        products = [
+            Product(
+                name=prod.name,
+                description=prod.description,
+                variants=prod.variants,
+                options=prod.options,
+                img_url=prod.img_url,
+                category=category_id,
+                subcategory=subcategory_id,
+                business=business_id,
+            )
+            for (sub, category_id), subcategory_id in zip(sub_sources, sub_result.inserted_ids)
+            for prod in sub.products
+        ]
+        if products:
+            await Product.insert_many(products, session=session)
+    return OK_TRUE
 
 
 @private_apiRouter.post(
@@ -227,7 +301,7 @@ async def post_product(data: ProductCreate, request: Request):
     await subcategory.fetch_link("category")
     category = subcategory.category
     business = category.business
-    if business.id != PydanticObjectId(request.state.user_scope):
+    if business.id != request.state.user_scope_oid:
         raise HTTP_404_NOT_FOUND("Không tìm thấy phân loại")
     data = data.model_dump()
     data["category"] = category
@@ -251,12 +325,18 @@ async def post_image_product(
 ):
     if image.content_type not in {"image/jpeg", "image/png", "image/webp"}:
         raise HTTP_400_BAD_REQUEST(message="Chỉ chấp nhận JPG, PNG, WEBP.")
+    # Kiểm tra magic bytes trước khi đụng tới phần thân còn lại
+    header = await image.read(12)
+    await image.seek(0)
+    if sniff_image_type(header) is None:
+        raise HTTP_400_BAD_REQUEST(message="Chỉ chấp nhận JPG, PNG, WEBP.")
     product = await productService.find(id)
-    if product is None or product.business.to_ref().id != PydanticObjectId(request.state.user_scope):
+    if product is None or product.business.to_ref().id != request.state.user_scope_oid:
         raise HTTP_404_NOT_FOUND("Không tìm thấy sản phẩm")
-    contents = await image.read()
-    object_name = QRCode.upload(
-        object=contents,
+    # Stream thẳng file tạm lên MinIO trong thread, không buffer bytes và không chặn event loop
+    object_name = await asyncio.to_thread(
+        QRCode.upload,
+        object=image.file,
         object_name=f"/product/product_{id}_{image.filename}",
         content_type=image.content_type,
     )
@@ -272,10 +352,13 @@ async def post_image_product(
     dependencies=[Depends(permission_required(permissions=["update.product"]))],
 )
 async def put_product(id: PydanticObjectId, data: ProductUpdate, request: Request):
-    product = await productService.find(id)
-    if product is None or product.business.to_ref().id != PydanticObjectId(request.state.user_scope):
+    # Gộp check sở hữu vào filter: 1 find_one_and_update, không còn khe TOCTOU
+    product = await productService.update_one_where(
+        conditions={"_id": id, "business.$id": request.state.user_scope_oid},
+        data=data,
+    )
+    if product is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy sản phẩm")
-    product = await productService.update(id, data)
     return Response(data=product)
 
 
@@ -287,9 +370,7 @@ async def put_product(id: PydanticObjectId, data: ProductUpdate, request: Reques
     dependencies=[Depends(permission_required(permissions=["delete.product"]))],
 )
 async def delete_product(id: PydanticObjectId, request: Request):
-    product = await productService.find(id)
-    if product is None or product.business.to_ref().id != PydanticObjectId(request.state.user_scope):
+    # Gộp check sở hữu vào filter: 1 find_one_and_delete, không còn khe TOCTOU
+    if not await productService.delete_where(conditions={"_id": id, "business.$id": request.state.user_scope_oid}):
         raise HTTP_404_NOT_FOUND("Không tìm thấy sản phẩm")
-    if not await productService.delete(id):
-        raise HTTP_400_BAD_REQUEST("Xóa thất bại")
-    return Response(data="Xóa thành công")
+    return OK_DELETED
@@ -1,22 +1,21 @@
+import asyncio
 import json
 from datetime import datetime, timedelta
 from typing import List, Optional
 
-from beanie import Link, PydanticObjectId
+from beanie import PydanticObjectId
 from fastapi import APIRouter, Depends, File, Form, Query, Request, UploadFile
 
-from app.api.dependency import login_required, permission_required, role_required
-from app.common.api_response import Response
+from app.api.dependency import get_current_business, login_required, permission_required, role_required
+from app.common.api_response import OK_TRUE, Response
 from app.common.http_exception import HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND
+from app.common.utils import ref_id, sniff_image_type
 from app.core.config import settings
 from app.core.decorator import limiter
 from app.db import Mongo, QRCode
 from app.models.request import RequestType
-from app.schema.area import AreaResponse
-from app.schema.branch import BranchResponse
 from app.schema.order import ExtenOrderCreate, OrderStatus
 from app.schema.request import MinimumResquestResponse, RequestCreate, RequestStatus, RequestUpdate, ResquestResponse
-from app.schema.service_unit import ServiceUnitResponse
 from app.service import (
     areaService,
     businessService,
@@ -76,25 +75,26 @@ async def get_extends(
 )
 async def put_extend(id: PydanticObjectId):
     async with extendOrderService.transaction(Mongo.client) as session:
-        order = await extendOrderService.find(id, session=session)
+        # fetch_links resolve business + plan ngay trong 1 lần đọc,
+        # thay cho fetch_all_links gọi thêm từng link nối tiếp
+        order = await extendOrderService.find(id, session=session, fetch_links=True)
         if order is None:
             raise HTTP_404_NOT_FOUND("Không tìm thấy đơn hàng")
         if order.status == OrderStatus.PAID:
             raise HTTP_400_BAD_REQUEST("Đơn hàng đã được xử lí")
-        await order.fetch_all_links()
         await extendOrderService.update(
             id,
             data={"status": OrderStatus.PAID},
             session=session,
         )
         await businessService.update(
-            id=order.business.to_ref().id,
+            id=order.business.id,
             data={
                 "expired_at": max(order.business.expired_at, datetime.now()) + timedelta(days=order.plan.period),
             },
             session=session,
         )
-        return Response(data=True)
+        return OK_TRUE
 
 
 @apiRouter.post(
@@ -111,16 +111,22 @@ async def request_extend(
     request: Request,
     plan: PydanticObjectId = Form(..., description="Gói đăng kí"),
     image: UploadFile = File(..., description="Ảnh thanh toán"),
+    business=Depends(get_current_business),
 ):
     if image.content_type not in {"image/jpeg", "image/png", "image/webp"}:
         raise HTTP_400_BAD_REQUEST(message="Chỉ chấp nhận JPG, PNG, WEBP.")
+    # Kiểm tra magic bytes trước khi đụng tới phần thân còn lại
+    header = await image.read(12)
+    await image.seek(0)
+    if sniff_image_type(header) is None:
+        raise HTTP_400_BAD_REQUEST(message="Chỉ chấp nhận JPG, PNG, WEBP.")
     plan = await planService.find(plan)
     if plan is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy gói đăng kí")
-    business = await businessService.find(request.state.user_scope)
-    contents = await image.read()
-    object_name = QRCode.upload(
-        object=contents,
+    # Stream thẳng file tạm lên MinIO trong thread, không buffer bytes và không chặn event loop
+    object_name = await asyncio.to_thread(
+        QRCode.upload,
+        object=image.file,
         object_name=f"/transaction/{request.state.user_id}_{image.filename}",
         content_type=image.content_type,
     )
@@ -145,34 +151,22 @@ async def get_requests(
     type: Optional[RequestType] = Query(default=None, description="Lọc theo type"),
     page: int = Query(default=1, ge=1),
     limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=50),
+    after: Optional[PydanticObjectId] = Query(default=None, description="Keyset: lấy trang sau _id này"),
 ):
-    conditions = {"business._id": PydanticObjectId(request.state.user_scope)}
+    conditions = {"business.$id": request.state.user_scope_oid}
+    if after:
+        # Keyset theo _id giảm dần: không tốn O(skip) khi lật trang sâu
+        conditions["_id"] = {"$lt": after}
     if request.state.user_branch:
-        conditions["branch._id"] = PydanticObjectId(request.state.user_branch)
+        conditions["branch.$id"] = request.state.user_branch_oid
     if status:
         conditions["status"] = status.value
     if type:
         conditions["type"] = type
-    requests = await requestService.find_many(
-        conditions=conditions, fetch_links=True, skip=(page - 1) * limit, limit=limit
+    # Aggregation join + fallback trên server, bỏ fetch_links lẫn vòng vá Link dangling
+    requests = await requestService.find_many_with_relations(
+        conditions=conditions, skip=None if after else (page - 1) * limit, limit=limit
     )
-    for request in requests:
-        if isinstance(request.service_unit, Link):
-            request.service_unit = ServiceUnitResponse(
-                id=request.service_unit.to_dict().get("id"), name="Không xác định"
-            )
-        if isinstance(request.area, Link):
-            request.area = AreaResponse(
-                id=request.area.to_dict().get("id"),
-                name="Không xác định",
-                branch=(
-                    BranchResponse(
-                        id=request.branch.to_dict().get("id"), name="Không xác định", address="Không xác định"
-                    )
-                    if isinstance(request.branch, Link)
-                    else request.branch
-                ),
-            )
     return Response(data=requests)
 
 
@@ -195,31 +189,45 @@ async def request(
         raise HTTP_400_BAD_REQUEST("Yêu cầu không phù hợp")
     area = await areaService.find(service_unit.area.to_ref().id)
     data = data.model_dump()
-    data["branch"] = area.branch.to_ref()
-    data["business"] = area.business.to_ref()
+    # Dựng ref 1 lần, tái dùng cho insert lẫn broadcast
+    branch_ref = area.branch.to_ref()
+    business_ref = area.business.to_ref()
+    data["branch"] = branch_ref
+    data["business"] = business_ref
     if data.get("type") == RequestType.ORDER:
         # -- Check valid order
         product_ids = [PydanticObjectId(e.get("_id")) for e in data.get("data")]
-        products = await productService.find_many(conditions={"_id": {"$in": product_ids}})
-        product_map = {str(product.id): product for product in products}
+        # $project chỉ kéo mảng type về (không cả document sản phẩm);
+        # set dựng 1 lần mỗi sản phẩm cho membership O(1) theo từng dòng hàng
+        products = await productService.aggregate(
+            [
+                {"$match": {"_id": {"$in": product_ids}}},
+                {"$project": {"variants": "$variants.type", "options": "$options.type"}},
+            ]
+        )
+        variant_sets = {str(product["_id"]): set(product["variants"]) for product in products}
+        option_sets = {str(product["_id"]): set(product["options"]) for product in products}
         for p in data.get("data"):
-            db_product = product_map.get(p.get("_id"))
-            print(db_product.variants)
-            if p.get("variant") not in [option.type for option in db_product.variants]:
-                raise HTTP_400_BAD_REQUEST("Kiểm tra thông tin đơn hàng")
-            if any(opt not in [option.type for option in db_product.options] for opt in p.get("options", [])):
+            product_id = p.get("_id")
+            if (
+                product_id not in variant_sets
+                or p.get("variant") not in variant_sets[product_id]
+                or not option_sets[product_id].issuperset(p.get("options", []))
+            ):
                 raise HTTP_400_BAD_REQUEST("Kiểm tra thông tin đơn hàng")
     req = await requestService.insert(data)
     await manager.broadcast(
+        # separators bỏ khoảng trắng: payload gọn và serialize nhanh hơn mặc định
         message=json.dumps(
             {
                 "message": f"{data.get("type")} {data.get("reason")}",
                 "request": str(req.id),
                 "data": data.get("data"),
-            }
+            },
+            separators=(",", ":"),
         ),
-        business=area.business.to_dict().get("id"),
-        branch=area.branch.to_dict().get("id"),
+        business=str(business_ref.id),
+        branch=str(branch_ref.id),
         permission="receive.request",
     )
     return Response(data=req)
@@ -231,17 +239,18 @@ async def process_request(id: PydanticObjectId, req: Request):
         request = await requestService.find(id, session=session)
         if request is None:
             raise HTTP_404_NOT_FOUND("Không tìm thấy yêu cầu")
-        if req.state.user_scope != request.business.to_dict().get("id"):
+        # So id qua ref_id: đọc thẳng DBRef, khỏi dựng dict trung gian mỗi lần so
+        if req.state.user_scope_oid != ref_id(request.business):
             raise HTTP_404_NOT_FOUND("Không tìm thấy yêu cầu")
-        if req.state.user_branch is not None and request.branch.to_dict().get("id") != req.state.user_branch:
+        if req.state.user_branch is not None and ref_id(request.branch) != req.state.user_branch_oid:
             raise HTTP_403_FORBIDDEN("Bạn không đủ quyền thực hiện hành động này")
         user = await userService.find(req.state.user_id, session=session)
         if request.status == RequestStatus.COMPLETED or (
-            request.status != RequestStatus.WAITING and request.staff.to_dict().get("id") != str(user.id)
+            request.status != RequestStatus.WAITING and ref_id(request.staff) != user.id
         ):
             await manager.broadcast(message="Yêu cầu đã được xử lí", user_ids=[PydanticObjectId(req.state.user_id)])
             return Response(data=False)
-        await requestService.update(
+        updated = await requestService.update(
             id,
             RequestUpdate(
                 status=request.status.next(),
@@ -249,4 +258,7 @@ async def process_request(id: PydanticObjectId, req: Request):
             ),
             session=session,
         )
-    return Response(data=True)
+    # update ghi qua find_one_and_update nên event Save của beanie không chạy:
+    # gọi tay hook tạo Order khi yêu cầu ORDER vừa chuyển sang COMPLETED
+    await updated.create_order_if_complete()
+    return OK_TRUE
@@ -1,11 +1,13 @@
+import asyncio
 from typing import List, Optional
 
 from beanie import PydanticObjectId
 from fastapi import APIRouter, Depends, File, Form, Query, Request, UploadFile
 
 from app.api.dependency import login_required, permission_required, role_required
-from app.common.api_response import Response
+from app.common.api_response import OK_DELETED, Response
 from app.common.http_exception import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND
+from app.common.utils import sniff_image_type
 from app.db import QRCode
 from app.schema.service_unit import ServiceUnitResponse, ServiceUnitUpdate
 from app.service import areaService, unitService
@@ -35,12 +37,28 @@ async def get_service(
     branch: Optional[PydanticObjectId] = Query(default=None, description="Lọc đơn vị theo chi nhánh"),
     area: Optional[PydanticObjectId] = Query(default=None, description="Lọc đơn vị theo khu vực"),
 ):
-    areas = await areaService.find_many(conditions={"business.$id": PydanticObjectId(request.state.user_scope)})
-    areas = [area.to_ref().id for area in areas]
-    conditions = {"area._id": {"$in": [area] if area else areas}}
-    services = await unitService.find_many(conditions, fetch_links=True)
+    # ServiceUnit mang sẵn link business/branch: lọc thẳng trên server,
+    # bỏ bước tải toàn bộ khu vực rồi lọc branch bằng Python sau fetch_links
+    conditions = {"business.$id": request.state.user_scope_oid}
+    if area:
+        conditions["area.$id"] = area
     if branch:
-        services = [service for service in services if service.area.branch.id == branch]
+        conditions["branch.$id"] = branch
+    pipeline = [
+        {"$match": conditions},
+        {"$lookup": {"from": "Area", "localField": "area.$id", "foreignField": "_id", "as": "area"}},
+        {"$unwind": {"path": "$area", "preserveNullAndEmptyArrays": True}},
+        {
+            "$lookup": {
+                "from": "Branch",
+                "localField": "area.branch.$id",
+                "foreignField": "_id",
+                "as": "area.branch",
+            }
+        },
+        {"$unwind": {"path": "$area.branch", "preserveNullAndEmptyArrays": True}},
+    ]
+    services = await unitService.aggregate(pipeline)
     return Response(data=services)
 
 
@@ -64,12 +82,18 @@ async def post_service(
     area = await areaService.find(area)
     if area is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy khu vực trong doanh nghiệp của bạn")
-    if PydanticObjectId(request.state.user_scope) != area.business.to_ref().id:
+    if request.state.user_scope_oid != area.business.to_ref().id:
         raise HTTP_404_NOT_FOUND("Không tìm thấy khu vực trong doanh nghiệp của bạn")
     if qr_code:
-        contents = await qr_code.read()
-        object_name = QRCode.upload(
-            object=contents,
+        # Kiểm tra magic bytes trước khi đụng tới phần thân còn lại
+        header = await qr_code.read(12)
+        await qr_code.seek(0)
+        if sniff_image_type(header) is None:
+            raise HTTP_400_BAD_REQUEST(message="Chỉ chấp nhận JPG, PNG, WEBP.")
+        # Stream thẳng file tạm lên MinIO trong thread, không buffer bytes và không chặn event loop
+        object_name = await asyncio.to_thread(
+            QRCode.upload,
+            object=qr_code.file,
             object_name=f"{request.state.user_id}_{qr_code.filename}",
             content_type=qr_code.content_type,
         )
@@ -107,16 +131,13 @@ async def put_service(
     data: ServiceUnitUpdate,
     request: Request,
 ):
-    service_unit = await unitService.find(id)
-    if service_unit is None:
-        raise HTTP_404_NOT_FOUND("Không tìm thấy")
-    area = await areaService.find(service_unit.area.to_ref().id)
-    if PydanticObjectId(request.state.user_scope) != area.business.to_ref().id:
-        raise HTTP_404_NOT_FOUND("Không tìm thấy dịch vụ trong doanh nghiệp của bạn")
-    service = await unitService.update(
-        id=id,
+    # ServiceUnit mang sẵn link business: gộp check sở hữu vào filter, 1 find_one_and_update
+    service = await unitService.update_one_where(
+        conditions={"_id": id, "business.$id": request.state.user_scope_oid},
         data=data,
     )
+    if service is None:
+        raise HTTP_404_NOT_FOUND("Không tìm thấy dịch vụ trong doanh nghiệp của bạn")
     await service.fetch_link("area")
     return Response(data=service)
 
@@ -132,9 +153,15 @@ async def post_qrcode(
 ):
     if qr_code.content_type not in {"image/jpeg", "image/png", "image/webp"}:
         raise HTTP_400_BAD_REQUEST(message="Chỉ chấp nhận JPG, PNG, WEBP.")
-    contents = await qr_code.read()
-    object_name = QRCode.upload(
-        object=contents,
+    # Kiểm tra magic bytes trước khi đụng tới phần thân còn lại
+    header = await qr_code.read(12)
+    await qr_code.seek(0)
+    if sniff_image_type(header) is None:
+        raise HTTP_400_BAD_REQUEST(message="Chỉ chấp nhận JPG, PNG, WEBP.")
+    # Stream thẳng file tạm lên MinIO trong thread, không buffer bytes và không chặn event loop
+    object_name = await asyncio.to_thread(
+        QRCode.upload,
+        object=qr_code.file,
         object_name=f"/qrcode/{id}_{qr_code.filename}",
         content_type=qr_code.content_type,
     )
@@ -157,12 +184,7 @@ async def post_qrcode(
     ],
 )
 async def delete_service(id: PydanticObjectId, request: Request):
-    service_unit = await unitService.find(id)
-    if service_unit is None:
-        raise HTTP_404_NOT_FOUND("Không tìm thấy")
-    area = await areaService.find(service_unit.area.to_ref().id)
-    if PydanticObjectId(request.state.user_scope) != area.business.to_ref().id:
+    # Gộp check sở hữu vào filter: 1 find_one_and_delete, không còn khe TOCTOU
+    if not await unitService.delete_where(conditions={"_id": id, "business.$id": request.state.user_scope_oid}):
         raise HTTP_404_NOT_FOUND("Không tìm thấy dịch vụ trong doanh nghiệp của bạn")
-    if not await unitService.delete(id):
-        return Response(data="Xóa thất bại")
-    return Response(data="Xóa thành công")
+    return OK_DELETED
@@ -1,6 +1,10 @@
+import asyncio
+from datetime import timedelta
 from typing import List, Literal, Optional
+from urllib.parse import urljoin
 
 from beanie import PydanticObjectId
+from bson import DBRef
 from fastapi import APIRouter, BackgroundTasks, Depends, Query, Request
 from fastapi_mail import MessageSchema, MessageType
 
@@ -8,10 +12,12 @@ from app.api.dependency import login_required, permission_required, role_require
 from app.common.api_message import KeyResponse, get_message
 from app.common.api_response import Response
 from app.common.http_exception import HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND, HTTP_409_CONFLICT
+from app.common.utils import render_email_template
 from app.core.config import settings
+from app.core.security import ACCESS_JWT
 from app.db import SessionManager
 from app.schema.user import FullUserResponse, Staff, UserResponse, UserUpdate
-from app.service import branchService, businessService, permissionService, userService
+from app.service import branchService, permissionService, userService
 
 apiRouter = APIRouter(
     tags=["User"],
@@ -39,21 +45,17 @@ async def get_users(
     request: Request,
     role: Optional[Literal["Admin", "BusinessOwner", "Staff"]] = Query(default=None, description="Lọc theo vai trò"),
 ):
-    user_scope = request.state.user_scope
-    if user_scope is None:
+    # 1 aggregation join branch thay cho fetch_links (1 query phụ mỗi Link mỗi user)
+    if request.state.user_scope is None:
         conditions = {}
         if role:
             conditions["role"] = role
-        users = await userService.find_many(conditions, projection_model=UserResponse, fetch_links=True)
     else:
-        users = await userService.find_many(
-            {
-                "business._id": PydanticObjectId(user_scope),
-                "role": "Staff",
-            },
-            projection_model=UserResponse,
-            fetch_links=True,
-        )
+        conditions = {
+            "business.$id": request.state.user_scope_oid,
+            "role": "Staff",
+        }
+    users = await userService.find_many_with_relations(conditions)
     return Response(data=users)
 
 
@@ -68,13 +70,17 @@ async def get_users(
     ],
 )
 async def get_user(id: PydanticObjectId, request: Request):
-    staff = await userService.find(id)
-    if staff is None:
+    # Check scope bằng projection chỉ chứa DBRef business; đọc full document
+    # (kèm fetch links) chỉ khi đã qua được authz
+    scope_doc = await userService.find_scope(id)
+    if scope_doc is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy")
     user_scope = request.state.user_scope
-    staff_scope = str(staff.business.to_ref().id)
+    business_ref = scope_doc.get("business")
+    staff_scope = str(business_ref.id) if business_ref else None
     if user_scope is not None and user_scope != staff_scope:
         raise HTTP_403_FORBIDDEN("Bạn không đủ quyền thực hiện hành động này")
+    staff = await userService.find(id)
     await staff.fetch_all_links()
     return Response(data=staff)
 
@@ -90,32 +96,24 @@ async def post_user(
     request: Request,
     task: BackgroundTasks,
 ):
-    def render_email_template(template_name: str, context: dict) -> str:
-        from jinja2 import Environment, FileSystemLoader
-
-        env = Environment(loader=FileSystemLoader("app/templates"))
-        template = env.get_template(template_name)
-        return template.render(**context)
-
-    branch = await branchService.find_one(
-        conditions={"_id": PydanticObjectId(data.branch), "business.$id": PydanticObjectId(request.state.user_scope)}
+    # Check chi nhánh và check trùng username độc lập nhau: bắn song song
+    branch, existed = await asyncio.gather(
+        branchService.find_one(
+            conditions={"_id": PydanticObjectId(data.branch), "business.$id": request.state.user_scope_oid}
+        ),
+        userService.find_one(conditions={"username": data.username}),
     )
     if branch is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy chi nhánh")
-    if await userService.find_one(conditions={"username": data.username}):
+    if existed:
         raise HTTP_409_CONFLICT("Tên đăng nhập đã được sử dụng")
     data = data.model_dump()
-    user_scope = request.state.user_scope
-    business = await businessService.find(user_scope)
-    data["business"] = business
+    # User chỉ lưu DBRef business: dựng ref từ scope trong token, khỏi tốn
+    # 1 round-trip đọc cả document Business
+    data["business"] = DBRef("Business", request.state.user_scope_oid)
     data["branch"] = branch
     staff = await userService.insert(data)
     if staff.email:
-        from datetime import timedelta
-        from urllib.parse import urljoin
-
-        from app.core.security import ACCESS_JWT
-
         token = ACCESS_JWT.encode(
             payload={
                 "user_id": str(staff.id),
@@ -159,23 +157,22 @@ async def post_permission(
     permissions: List[PydanticObjectId],
     request: Request,
 ):
-    staff = await userService.find_one(
-        conditions={
-            "_id": id,  # Tìm theo id
-            "role": "Staff",  # Là nhân viên của doanh nghiệp
-            "business.$id": PydanticObjectId(request.state.user_scope),
-        }
+    # Check nhân viên và resolve quyền độc lập nhau: bắn song song, bớt 1 round-trip
+    staff, permissions = await asyncio.gather(
+        userService.find_one(
+            conditions={
+                "_id": id,  # Tìm theo id
+                "role": "Staff",  # Là nhân viên của doanh nghiệp
+                "business.$id": request.state.user_scope_oid,
+            }
+        ),
+        permissionService.find_many(conditions={"_id": {"$in": permissions}}),
     )
     if staff is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy nhân viên trong doanh nghiệp của bạn")
-    permissions = await permissionService.find_many(
-        conditions={
-            "_id": {"$in": permissions},
-        }
-    )
     staff = await userService.update(
         id=staff.id,
-        data={"permissions": permissions},  # [perm.to_ref() for perm in permissions]
+        data={"permissions": permissions, "perms_version": staff.perms_version + 1},
     )
     await staff.fetch_all_links()
     return Response(data=staff)
@@ -196,23 +193,25 @@ async def post_permission(
     deprecated=True,
 )
 async def delete_permission(id: PydanticObjectId, permissions: List[PydanticObjectId], request: Request):
-    staff = await userService.find_one(
-        conditions={
-            "_id": id,  # Tìm theo id
-            "role": "Staff",  # Là nhân viên của doanh nghiệp
-            "business.$id": PydanticObjectId(request.state.user_scope),
-        }
+    # Check nhân viên và resolve quyền độc lập nhau: bắn song song, bớt 1 round-trip
+    staff, permissions = await asyncio.gather(
+        userService.find_one(
+            conditions={
+                "_id": id,  # Tìm theo id
+                "role": "Staff",  # Là nhân viên của doanh nghiệp
+                "business.$id": request.state.user_scope_oid,
+            }
+        ),
+        permissionService.find_many(conditions={"_id": {"$in": permissions}}),
     )
     if staff is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy nhân viên trong doanh nghiệp của bạn")
-    permissions = await permissionService.find_many(
-        conditions={
-            "_id": {"$in": permissions},
-        }
-    )
     staff = await userService.update_one(
         id=staff.id,
-        conditions={"$pull": {"permissions": {"$in": [p.id for p in permissions]}}},
+        conditions={
+            "$pull": {"permissions": {"$in": [p.id for p in permissions]}},
+            "$inc": {"perms_version": 1},
+        },
     )
     await staff.fetch_all_links()
     return Response(data=staff)
@@ -237,22 +236,14 @@ async def put_user(
     data: UserUpdate,
     request: Request,
 ):
+    # Gộp check sở hữu vào filter update: 1 find_one_and_update thay vì find + update
+    conditions = {"_id": id}
     if request.state.user_role != "Admin":
-        user = await userService.find_one(
-            {
-                "_id": id,
-                "role": "Staff",
-            }
-        )
-        if user is None or user.business.to_ref().id != PydanticObjectId(request.state.user_scope):
-            raise HTTP_404_NOT_FOUND("Không tìm thấy người dùng trong doanh nghiệp của bạn")
-    else:
-        user = await userService.find_one(
-            {"_id": id},
-        )
-        if user is None:
-            raise HTTP_404_NOT_FOUND("Không tìm thấy người dùng trong doanh nghiệp của bạn")
-    user = await userService.update(id, data)
+        conditions["role"] = "Staff"
+        conditions["business.$id"] = request.state.user_scope_oid
+    user = await userService.update_one_where(conditions=conditions, data=data)
+    if user is None:
+        raise HTTP_404_NOT_FOUND("Không tìm thấy người dùng trong doanh nghiệp của bạn")
     await user.fetch_all_links()
     return Response(data=user)
 
@@ -279,15 +270,18 @@ async def lock_unlock_user(
     def remove_session(user_id: str):
         SessionManager.delete(user_id)
 
-    user = await userService.find(id)
-    if user is None:
+    # Projection business + available là đủ cho authz và tính trạng thái mới,
+    # khỏi đọc (và materialize) cả document trước khi update
+    scope_doc = await userService.find_scope(id)
+    if scope_doc is None:
         raise HTTP_404_NOT_FOUND("Không tìm thấy")
     user_request_scope = request.state.user_scope
-    if user_request_scope is None or user_request_scope == str(user.business.to_ref().id):
+    business_ref = scope_doc.get("business")
+    if user_request_scope is None or user_request_scope == str(business_ref.id if business_ref else None):
         user = await userService.update(
             id=id,
             data={
-                "available": not user.available,
+                "available": not scope_doc.get("available"),
             },
         )
         task.add_task(remove_session, str(id))
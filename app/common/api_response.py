@@ -1,5 +1,6 @@
 from typing import Generic, Optional, TypeVar
 
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, ConfigDict
 
 from app.common.api_message import KeyResponse
@@ -11,3 +12,9 @@ class Response(BaseModel, Generic[Object]):
     model_config = ConfigDict(exclude_none=True)
     message: str = KeyResponse.SUCCESS
     data: Optional[Object] = None
+
+
+# Thân phản hồi hằng cho các endpoint ghi/xóa: dựng sẵn 1 lần lúc import,
+# mỗi lần trả về bỏ hẳn bước validate response_model + jsonable_encoder
+OK_TRUE = JSONResponse(content=Response(data=True).model_dump())
+OK_DELETED = JSONResponse(content=Response(data="Xóa thành công").model_dump())
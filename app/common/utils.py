@@ -0,0 +1,36 @@
+from typing import Any, Optional
+
+from beanie import Document, PydanticObjectId
+from jinja2 import Environment, FileSystemLoader
+
+# Environment dựng 1 lần khi load module; template đã biên dịch được cache bên trong,
+# auto_reload=False để get_template không stat lại file mỗi lần render
+_TEMPLATE_ENV = Environment(loader=FileSystemLoader("app/templates"), auto_reload=False)
+
+
+def render_email_template(template_name: str, context: dict) -> str:
+    """Render template email với Environment dùng chung, không dựng lại mỗi request."""
+    return _TEMPLATE_ENV.get_template(template_name).render(**context)
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    """Đoán MIME ảnh từ magic bytes (12 byte đầu), không tin content_type client gửi."""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def ref_id(link: Any) -> Optional[PydanticObjectId]:
+    """Đọc ObjectId của Link trực tiếp từ DBRef, không tạo đối tượng trung gian."""
+    if link is None:
+        return None
+    if isinstance(link, Document):
+        return link.id
+    return link.ref.id
+
+
+__all__ = ["ref_id", "render_email_template", "sniff_image_type"]
@@ -1,82 +1,121 @@
 import json
 import time
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
 
 import httpx
 import sentry_sdk
-from fastapi import Request
 from fastapi.exceptions import ResponseValidationError
 from fastapi.responses import JSONResponse
 from loguru import logger
 from pydantic import ValidationError
 from pymongo.errors import DuplicateKeyError, PyMongoError
-from starlette.middleware.base import BaseHTTPMiddleware
 
 from app.common.api_message import KeyResponse, get_message
 
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    def _get_request_info(self, request: Request) -> Dict[str, Any]:
+def _handle_timeout(e: Exception) -> Tuple[int, str, Any]:
+    return 500, KeyResponse.SERVER_ERROR, "Hệ thống đang bận, vui lòng thử lại sau."
+
+
+def _handle_validation(e: Exception) -> Tuple[int, str, Any]:
+    return 422, KeyResponse.VALIDATION_ERROR, [f"{error['msg']} {error['loc']}" for error in e.errors()]
+
+
+def _handle_duplicate(e: Exception) -> Tuple[int, str, Any]:
+    return 409, KeyResponse.CONFLICT, e.details["errmsg"]
+
+
+def _handle_mongo(e: Exception) -> Tuple[int, str, Any]:
+    return 500, KeyResponse.SERVER_ERROR, "Không thể xử lý yêu cầu. Vui lòng thử lại sau."
+
+
+# Bảng tra (class lỗi -> handler) thay chuỗi isinstance: duyệt __mro__ nên
+# subclass vẫn khớp đúng handler gần nhất (DuplicateKeyError trước PyMongoError)
+_HANDLERS: Dict[type, Any] = {
+    httpx.ConnectTimeout: _handle_timeout,
+    ResponseValidationError: _handle_validation,
+    ValidationError: _handle_validation,
+    DuplicateKeyError: _handle_duplicate,
+    PyMongoError: _handle_mongo,
+}
+
+
+class LoggingMiddleware:
+    """Middleware ASGI thuần: bỏ lớp BaseHTTPMiddleware vốn tốn thêm 1 task
+    và cặp memory stream anyio cho mỗi request chỉ để ghi log."""
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _get_request_info(scope) -> Dict[str, Any]:
         """Extract common request information"""
+        user_agent = "unknown"
+        for key, value in scope["headers"]:
+            if key == b"user-agent":
+                user_agent = value.decode("latin-1")
+                break
+        client = scope.get("client")
         return {
-            "request_id": request.state.request_id,
-            "host": request.client.host,
-            "user_agent": request.headers.get("user-agent", "unknown"),
-            "method": request.method,
-            "path": request.url.path,
+            # TraceMiddleware (chạy phía trong) gắn request_id vào scope["state"]
+            "request_id": scope.get("state", {}).get("request_id"),
+            "host": client[0] if client else None,
+            "user_agent": user_agent,
+            "method": scope["method"],
+            "path": scope["path"],
         }
 
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         request_time = datetime.now()
         start_time = time.time()
+        response_status = 500
+
+        async def send_wrapper(message):
+            nonlocal response_status
+            if message["type"] == "http.response.start":
+                response_status = message["status"]
+            await send(message)
+
         try:
-            response = await call_next(request)
-            duration = time.time() - start_time
+            await self.app(scope, receive, send_wrapper)
+            # duration ghi bằng int micro giây: không tốn float→str dài khi serialize
+            duration_us = int((time.time() - start_time) * 1_000_000)
             log_data = {
                 "timestamp": request_time.isoformat(),
-                **self._get_request_info(request),
-                "duration": duration,
-                "status_code": response.status_code,
+                **self._get_request_info(scope),
+                "duration_us": duration_us,
+                "status_code": response_status,
                 "error": None,
             }
-            logger.info(json.dumps(log_data))
-            return response
+            logger.info(json.dumps(log_data, separators=(",", ":")))
         except Exception as e:
-            duration = time.time() - start_time
-            status_code = 500
-            error = KeyResponse.SERVER_ERROR
-            message = get_message(KeyResponse.SERVER_ERROR)
-            if isinstance(e, httpx.ConnectTimeout):
-                message = "Hệ thống đang bận, vui lòng thử lại sau."
-            elif isinstance(e, ResponseValidationError):
-                status_code = 422
-                error = KeyResponse.VALIDATION_ERROR
-                message = [f"{error['msg']} {error['loc']}" for error in e.errors()]
-            elif isinstance(e, ValidationError):
-                status_code = 422
-                error = KeyResponse.VALIDATION_ERROR
-                message = [f"{error['msg']} {error['loc']}" for error in e.errors()]
-            elif isinstance(e, DuplicateKeyError):
-                status_code = 409
-                error = KeyResponse.CONFLICT
-                message = e.details["errmsg"]
-            elif isinstance(e, PyMongoError):
-                message = "Không thể xử lý yêu cầu. Vui lòng thử lại sau."
+            duration_us = int((time.time() - start_time) * 1_000_000)
+            for cls in type(e).__mro__:
+                if handler := _HANDLERS.get(cls):
+                    status_code, error, message = handler(e)
+                    break
             else:
+                status_code = 500
+                error = KeyResponse.SERVER_ERROR
+                message = get_message(KeyResponse.SERVER_ERROR)
                 sentry_sdk.capture_exception(e)
             log_data = {
                 "timestamp": request_time.isoformat(),
-                **self._get_request_info(request),
-                "duration": duration,
+                **self._get_request_info(scope),
+                "duration_us": duration_us,
                 "status_code": status_code,
                 "error": type(e).__name__,
             }
-            logger.error(json.dumps(log_data))
-            return JSONResponse(
+            logger.error(json.dumps(log_data, separators=(",", ":")))
+            response = JSONResponse(
                 status_code=status_code,
                 content={
                     "error": error,
                     "message": message,
                 },
             )
+            await response(scope, receive, send)
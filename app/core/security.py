@@ -1,4 +1,5 @@
 import datetime
+import time
 
 import jwt
 from fastapi.encoders import jsonable_encoder
@@ -13,10 +14,16 @@ class JWTSecurity:
         secret_key: str,
         algorithm: str = "HS256",
         expires_delta: datetime.timedelta | None = None,
+        cache_ttl: int = 60,
+        cache_size: int = 10_000,
     ):
         self._algorithm = algorithm
         self._expires_delta = expires_delta
         self._secret_key = secret_key
+        # Memo payload đã verify theo token, TTL ngắn để khỏi verify HMAC lặp lại
+        self._cache: dict = {}
+        self._cache_ttl = cache_ttl
+        self._cache_size = cache_size
 
     def encode(self, payload: dict | BaseModel, expires_delta: datetime.timedelta | None = None) -> str:
         if expires_delta is None:
@@ -33,7 +40,18 @@ class JWTSecurity:
         return token
 
     def decode(self, token: str):
-        return jwt.decode(token, self._secret_key, algorithms=[self._algorithm])
+        now = time.monotonic()
+        entry = self._cache.get(token)
+        if entry and entry[0] > now:
+            # Trả về bản copy vì caller có thể mutate (vd. pop("exp"))
+            return dict(entry[1])
+        payload = jwt.decode(token, self._secret_key, algorithms=[self._algorithm])
+        if len(self._cache) >= self._cache_size:
+            self._cache.clear()
+        # Không cache quá hạn của chính token
+        remaining = payload.get("exp", 0) - time.time()
+        self._cache[token] = (now + min(self._cache_ttl, remaining), payload)
+        return dict(payload)
 
 
 ACCESS_JWT = JWTSecurity(
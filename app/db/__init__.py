@@ -1,5 +1,5 @@
 from .minio import QRCode
 from .mongo import Mongo
-from .redis import LimitManager, SessionManager
+from .redis import LimitManager, PermissionCache, SessionManager
 
-__all__ = ["Mongo", "SessionManager", "QRCode", "LimitManager"]
+__all__ = ["Mongo", "SessionManager", "QRCode", "LimitManager", "PermissionCache"]
@@ -25,7 +25,17 @@ from app.models import (
     User,
 )
 from app.schema.user import Administrator
-from app.service import permissionService, userService
+from app.service import userService
+
+
+def _permission_table(documents: List[Document]) -> dict:
+    # Bảng (code -> description) là hằng theo danh sách model: dựng 1 lần lúc
+    # import thay vì format lại chuỗi ở mỗi lần khởi động process/worker
+    return {
+        f"{action.lower()}.{document.__name__.lower()}": f"{action.upper()} {document.__name__.upper()}"
+        for document in documents
+        for action in document.get_actions()
+    }
 
 
 class MongoDB:
@@ -35,30 +45,54 @@ class MongoDB:
         database: str,
         documents: List[Document],
     ):
-        self.client = AsyncMongoClient(url)
+        # 1 client dùng chung cả app: pool ghim theo settings thay vì mặc định 100,
+        # timeout chọn server/chờ pool ngắn để Mongo nghẽn không treo request vô hạn
+        self.client = AsyncMongoClient(
+            url,
+            maxPoolSize=settings.MONGO_POOL_SIZE,
+            minPoolSize=4,
+            waitQueueTimeoutMS=2000,
+            serverSelectionTimeoutMS=2000,
+        )
         self.database = database
         self.documents = documents
+        self.permission_table = _permission_table(documents)
 
     async def initialize(self):
         await init_beanie(
             database=self.client[self.database],
             document_models=self.documents,
         )
-        # Init Permission
-        permissions = []
-        for document in self.documents:
-            for action in document.get_actions():
-                code = f"{action.lower()}.{document.__name__.lower()}"
-                description = f"{action.upper()} {document.__name__.upper()}"
-                if await permissionService.find_one({"code": code}) is None:
-                    permissions.append(Permission(code=code, description=description))
-        try:
-            if permissions:
-                await permissionService.insert_many(permissions)
-        except BulkWriteError:
-            pass
-        except Exception as e:
-            logger.error(e)
+        # Init Permission: 1 query $in lấy code đã có rồi diff với bảng hằng
+        # đã dựng sẵn lúc import, thay vì 1 find_one mỗi cặp (document, action)
+        wanted = self.permission_table
+        existing = {
+            permission["code"]
+            async for permission in Permission.get_pymongo_collection().find(
+                {"code": {"$in": list(wanted)}}, {"_id": 0, "code": 1}
+            )
+        }
+        permissions = [
+            Permission(code=code, description=description)
+            for code, description in wanted.items()
+            if code not in existing
+        ]
+        if permissions:
+            try:
+                # ordered=False: trùng code (worker khác seed song song) không làm
+                # Mongo dừng cả batch, các document còn lại vẫn được ghi
+                await Permission.insert_many(permissions, ordered=False)
+            except BulkWriteError as e:
+                write_errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+                if write_errors:
+                    logger.error(write_errors)
+        # Backfill name_lc cho BusinessType cũ: hook set_name_lc chỉ chạy lúc
+        # ghi mới, document tồn tại trước đó chưa có field nên filter theo
+        # name_lc sẽ lặng lẽ không match gì nếu không đắp 1 lần ở đây
+        await BusinessType.get_pymongo_collection().update_many(
+            {"name_lc": None},
+            [{"$set": {"name_lc": {"$toLower": "$name"}}}],
+        )
         # Init Admin
         if not await userService.find_one({"username": "admin"}):
             await userService.insert(
@@ -1,4 +1,6 @@
-from typing import List
+import json
+import time
+from typing import List, Optional
 
 import redis
 
@@ -57,6 +59,41 @@ class TrackingClient(RedisClient):
         return self.client.incr(key)
 
 
+class PermissionCacheClient(RedisClient):
+    """Cache danh sách mã quyền đã resolve, khóa theo (user_id, perms_version)."""
+
+    def __init__(self, url, ttl: int = 3600, local_size: int = 1024, **kwargs):
+        super().__init__(url, "perms:", **kwargs)
+        self.ttl = ttl
+        # L1 trong tiến trình trước Redis: key -> (hết hạn, codes)
+        self._local: dict = {}
+        self._local_size = local_size
+
+    def get_codes(self, user_id, version: int) -> Optional[List[str]]:
+        key = f"{user_id}:{version}"
+        entry = self._local.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        cached = self.get(key)
+        if cached is None:
+            return None
+        codes = json.loads(cached)
+        self._set_local(key, codes)
+        return codes
+
+    def set_codes(self, user_id, version: int, codes: List[str]) -> bool:
+        key = f"{user_id}:{version}"
+        self._set_local(key, codes)
+        return self.set(key, json.dumps(codes), ex=self.ttl)
+
+    def _set_local(self, key: str, codes: List[str]):
+        if len(self._local) >= self._local_size:
+            self._local.clear()
+        self._local[key] = (time.monotonic() + min(self.ttl, 60), codes)
+
+
 SessionManager = SessionClient(settings.REDIS_URL, decode_responses=True)
 
 LimitManager = TrackingClient(settings.REDIS_URL, decode_responses=True)
+
+PermissionCache = PermissionCacheClient(settings.REDIS_URL, decode_responses=True)
@@ -1,5 +1,6 @@
 from contextlib import asynccontextmanager
 
+import httpx
 import sentry_sdk
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.exceptions import RequestValidationError
@@ -9,15 +10,16 @@ from fastapi.responses import JSONResponse
 from app.api.router import api
 from app.common.api_message import KeyResponse
 from app.common.http_exception import HTTP_ERROR
-from app.core.config import settings
+from app.core.config import configure_logging, settings
 from app.core.middleware import LoggingMiddleware, TraceMiddleware
 from app.db import Mongo
 from app.socket import manager
 
 
 @asynccontextmanager
-async def lifespan(_: FastAPI):
+async def lifespan(app: FastAPI):
     # on_startup
+    configure_logging(settings)
     sentry_sdk.init(
         dsn="https://133542f745a7150d8828eda864d3c33c@o4509676361023488.ingest.us.sentry.io/4509676365873152",
         send_default_pii=True,
@@ -26,8 +28,16 @@ async def lifespan(_: FastAPI):
         attach_stacktrace=True,
     )
     await Mongo.initialize()
+    # 1 connection pool httpx dùng chung cả app (vietqr), giữ keep-alive thay vì
+    # bắt tay TLS mỗi request; timeout tách connect/read để upstream treo không dồn request
+    app.state.http = httpx.AsyncClient(
+        base_url="https://api.vietqr.io",
+        timeout=httpx.Timeout(connect=2, read=5, write=5, pool=1),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60),
+    )
     yield
     # on_shutdown
+    await app.state.http.aclose()
 
 
 app = FastAPI(
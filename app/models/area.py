@@ -3,6 +3,7 @@ from typing import Optional
 from beanie import Link
 from pydantic import Field
 from pymongo import IndexModel
+from pymongo.collation import Collation
 
 from app.models.base import Base
 from app.models.branch import Branch
@@ -21,12 +22,21 @@ class Area(Base):
 
     class Settings:
         indexes = [
+            # Collation strength=2: so khớp tên không phân biệt hoa thường ngay trên index
             IndexModel(
                 [
+                    ("branch.$id", 1),
                     ("name", 1),
-                    ("branch", 1),
-                    ("business", 1),
                 ],
+                name="branch_name_ci",
                 unique=True,
-            )
+                collation=Collation(locale="en", strength=2),
+            ),
+            # Lọc theo scope (view_areas, cascade delete) không dùng collation
+            IndexModel(
+                [
+                    ("business.$id", 1),
+                    ("branch.$id", 1),
+                ]
+            ),
         ]
@@ -1,6 +1,7 @@
 from beanie import Link
 from pydantic import Field
 from pymongo import IndexModel
+from pymongo.collation import Collation
 
 from app.models.business import Business
 
@@ -17,9 +18,13 @@ class Branch(Base):
         indexes = [
             IndexModel(
                 [
+                    ("business.$id", 1),
                     ("name", 1),
-                    ("business", 1),
                 ],
+                name="business_name_ci",
                 unique=True,
-            )
+                collation=Collation(locale="en", strength=2),
+            ),
+            # Index thường cho lọc theo doanh nghiệp (collation index không phục vụ được)
+            IndexModel([("business.$id", 1)]),
         ]
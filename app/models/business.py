@@ -1,19 +1,35 @@
 from datetime import datetime, timedelta
 from typing import Optional
 
-from beanie import Link
+from beanie import Insert, Link, Replace, SaveChanges, Update, before_event
 from pydantic import Field
 from pymongo import IndexModel
+from pymongo.collation import Collation
 
 from .base import Base
 
 
 class BusinessType(Base):
     name: str = Field(..., description="Unique business type name")
+    # Bản lowercase của name để lọc theo prefix trên b-tree index thay vì regex /i
+    name_lc: Optional[str] = Field(default=None)
     description: Optional[str] = Field(default=None, description="Optional description")
 
     class Settings:
-        indexes = [IndexModel([("name", 1)], unique=True)]
+        indexes = [
+            # Collation strength=2: check trùng tên không phân biệt hoa thường ngay trên index
+            IndexModel(
+                [("name", 1)],
+                name="business_type_name_ci",
+                unique=True,
+                collation=Collation(locale="en", strength=2),
+            ),
+            IndexModel([("name_lc", 1)]),
+        ]
+
+    @before_event([Insert, Update, Replace, SaveChanges])
+    def set_name_lc(self):
+        self.name_lc = self.name.lower()
 
 
 class Business(Base):
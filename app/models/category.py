@@ -3,6 +3,7 @@ from typing import Optional
 from beanie import Link
 from pydantic import Field
 from pymongo import IndexModel
+from pymongo.collation import Collation
 
 from app.models import Business
 
@@ -16,13 +17,16 @@ class Category(Base):
 
     class Settings:
         indexes = [
+            # Collation strength=2: check trùng tên phân loại trong doanh nghiệp ngay trên index
             IndexModel(
                 [
+                    ("business.$id", 1),
                     ("name", 1),
-                    ("business", 1),
                 ],
+                name="business_category_name_ci",
                 unique=True,
-            )
+                collation=Collation(locale="en", strength=2),
+            ),
         ]
 
 
@@ -41,5 +45,14 @@ class SubCategory(Base):
                     ("business", 1),
                 ],
                 unique=True,
-            )
+            ),
+            # Check scope (_id + business.$id) và listing theo doanh nghiệp
+            IndexModel(
+                [
+                    ("business.$id", 1),
+                    ("category.$id", 1),
+                ]
+            ),
+            # Lọc theo phân loại và cascade delete
+            IndexModel([("category.$id", 1)]),
         ]
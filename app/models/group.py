@@ -3,6 +3,7 @@ from typing import List, Optional
 from beanie import Link
 from pydantic import Field
 from pymongo import IndexModel
+from pymongo.collation import Collation
 
 from app.models.business import Business
 from app.models.permission import Permission
@@ -17,14 +18,19 @@ class Group(Base):
     permissions: List[Link[Permission]] = Field(
         default_factory=list,
     )
+    # Tăng mỗi khi danh sách quyền của nhóm thay đổi
+    perms_version: int = Field(default=0)
 
     class Settings:
         indexes = [
+            # Collation strength=2: check trùng tên nhóm trong doanh nghiệp ngay trên index
             IndexModel(
                 [
+                    ("business.$id", 1),
                     ("name", 1),
-                    ("business", 1),
                 ],
+                name="business_group_name_ci",
                 unique=True,
-            )
+                collation=Collation(locale="en", strength=2),
+            ),
         ]
@@ -3,6 +3,7 @@ from typing import List
 
 from beanie import Link
 from pydantic import Field
+from pymongo import IndexModel
 
 from .base import Base
 
@@ -38,6 +39,16 @@ class Order(Base):
     # Payment Method
     payment_method: PaymentMethod = Field(default=PaymentMethod.CASH)
 
+    class Settings:
+        indexes = [
+            # Thống kê doanh số: lọc theo doanh nghiệp + trạng thái + khoảng thời gian
+            IndexModel([("business.$id", 1), ("status", 1), ("created_at", -1)]),
+            # Danh sách đơn lọc theo chi nhánh
+            IndexModel([("business.$id", 1), ("branch.$id", 1), ("created_at", -1)]),
+            # Lọc thống kê theo sản phẩm trong items
+            IndexModel([("items.product.$id", 1)]),
+        ]
+
 
 class ExtendOrder(Base):
     business: "Link[Business]" = Field(description="Doanh nghiệp muốn gia hạn")  # type: ignore  # noqa: F821
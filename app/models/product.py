@@ -36,5 +36,10 @@ class Product(Base):
                     ("business", 1),
                 ],
                 unique=True,
-            )
+            ),
+            # Danh sách sản phẩm lọc theo doanh nghiệp + danh mục + phân loại chi tiết
+            IndexModel([("business.$id", 1), ("category.$id", 1), ("subcategory.$id", 1)]),
+            # Cascade delete / check trùng theo phân loại
+            IndexModel([("category.$id", 1)]),
+            IndexModel([("subcategory.$id", 1)]),
         ]
@@ -3,6 +3,7 @@ from typing import List, Optional
 
 from beanie import Link, PydanticObjectId, Save, after_event
 from pydantic import Field
+from pymongo import IndexModel
 
 from app.models.base import Base
 
@@ -44,6 +45,12 @@ class Request(Base):
     # Ghi đè __action__ để thêm hành động 'share'
     __action__: List[str] = ["view", "receive", "delete", "update"]
 
+    class Settings:
+        indexes = [
+            # Danh sách yêu cầu lọc theo doanh nghiệp/chi nhánh + trạng thái + loại
+            IndexModel([("business.$id", 1), ("branch.$id", 1), ("status", 1), ("type", 1)]),
+        ]
+
     @after_event([Save])
     async def create_order_if_complete(self):
         if self.status == RequestStatus.COMPLETED and self.type == RequestType.ORDER:
@@ -26,5 +26,8 @@ class ServiceUnit(Base):
                     ("business", 1),
                 ],
                 unique=True,
-            )
+            ),
+            # Cascade delete và lọc theo chi nhánh/khu vực
+            IndexModel([("branch.$id", 1)]),
+            IndexModel([("area.$id", 1)]),
         ]
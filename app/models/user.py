@@ -1,3 +1,4 @@
+import asyncio
 from typing import List, Literal, Optional
 
 import bcrypt
@@ -6,6 +7,7 @@ from pydantic import Field
 from pymongo import IndexModel
 from typing_extensions import Self
 
+from app.core.config import settings
 from app.models.branch import Branch
 from app.models.business import Business
 from app.models.group import Group
@@ -25,6 +27,8 @@ class User(Base):
     image_url: Optional[str] = Field(default=None)
     role: Literal["Admin", "BusinessOwner", "Staff"] = Field(default="Staff")
     available: bool = Field(True)
+    # Tăng mỗi khi quyền/nhóm thay đổi để vô hiệu cache quyền đã resolve
+    perms_version: int = Field(default=0)
     permissions: List[Link[Permission]] = Field(default_factory=list)
     branch: Optional[Link[Branch]] = Field(default=None)
     group: List[Link[Group]] = Field(default_factory=list)
@@ -33,18 +37,36 @@ class User(Base):
     class Settings:
         indexes = [
             IndexModel([("username", 1)], unique=True),
+            # Lọc nhân viên theo doanh nghiệp (+role) và cascade delete theo chi nhánh;
+            # prefix business.$id của index ghép phục vụ luôn các query chỉ theo doanh nghiệp
+            IndexModel([("business.$id", 1), ("role", 1)]),
+            # Lọc toàn hệ thống theo vai trò (get_users của Admin)
+            IndexModel([("role", 1)]),
+            IndexModel([("branch.$id", 1)]),
+            # $pull reference nhóm khi xóa nhóm / vô hiệu cache quyền theo nhóm
+            IndexModel([("group.$id", 1)]),
+            # Tra cứu tài khoản công khai theo email
+            IndexModel([("email", 1)]),
         ]
 
+    @staticmethod
+    async def _hash(password: str) -> str:
+        # bcrypt với cost 12 tốn ~250ms CPU: đẩy sang thread để không chặn
+        # event loop, cost đọc từ settings nên dev/test hạ xuống được
+        salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
+        hashed = await asyncio.to_thread(bcrypt.hashpw, password.encode("utf-8"), salt)
+        return hashed.decode("utf-8")
+
     @before_event(Insert)
-    def hash_password(self):
+    async def hash_password(self):
         if self.role not in ["Admin", "BusinessOwner", "Staff"]:
             raise Exception("Role")
         if not self.password.startswith("$2b$"):
-            self.password = bcrypt.hashpw(self.password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+            self.password = await self._hash(self.password)
 
-    def change_password(self, new_password: str) -> Self:
+    async def change_password(self, new_password: str) -> Self:
         if not new_password.startswith("$2b$"):
-            self.password = bcrypt.hashpw(new_password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+            self.password = await self._hash(new_password)
         return self
 
     def verify_password(self, password: str) -> bool:
@@ -60,6 +60,9 @@ class FullBusinessResponse(BaseResponse):
     def serializer_owner(cls, v: Optional[User]):
         from app.schema.user import UserResponse
 
+        # Link chưa fetch (endpoint exclude owner) thì bỏ qua thay vì lỗi validate
+        if v is None or isinstance(v, Link):
+            return None
         return UserResponse.model_validate(v)
 
 
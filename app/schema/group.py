@@ -1,10 +1,13 @@
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 
 from pydantic import BaseModel, Field
 
 from app.schema import BaseResponse
 from app.schema.permission import DetailPermissionResponse
 
+if TYPE_CHECKING:
+    from app.schema.user import UserResponse
+
 
 class GroupCreate(BaseModel):
     name: str
@@ -23,13 +26,16 @@ class GroupResponse(BaseResponse):
 
 
 class FullGroupResponse(GroupResponse):
-    users: Optional[List[BaseModel]] = []
+    # Forward ref vì schema.user import ngược lại module này; resolve trong from_model
+    users: Optional[List["UserResponse"]] = []
 
     @classmethod
     async def from_model(cls, model: BaseModel) -> "FullGroupResponse":
         from app.schema.user import UserResponse
         from app.service import userService
 
+        if not cls.__pydantic_complete__:
+            cls.model_rebuild(_types_namespace={"UserResponse": UserResponse})
         data = model.model_dump()
         users = await userService.find_many(
             conditions={"group.$id": {"$in": [model.id]}}, projection_model=UserResponse
@@ -1,7 +1,8 @@
 from typing import Any, List, Optional
 
 from beanie import Link
-from pydantic import BaseModel, Field
+from bson import DBRef
+from pydantic import BaseModel, Field, field_validator
 
 from app.models import Area, Branch, Business, Plan, Request, ServiceUnit, User
 from app.models.order import OrderStatus, PaymentMethod
@@ -38,6 +39,16 @@ class MinimumOrderResponse(BaseResponse):
     amount: float
     status: OrderStatus
 
+    @field_validator("items", mode="before")
+    @classmethod
+    def stringify_product_refs(cls, items):
+        # Đổi DBRef sản phẩm thành str id ngay lúc dựng model,
+        # khỏi cần vòng hậu xử lý từng item trong handler
+        return [
+            {**item, "product": str(item["product"].id)} if isinstance(item.get("product"), DBRef) else item
+            for item in items
+        ]
+
 
 class OrderResponse(BaseResponse):
     items: List[Any]
@@ -1,9 +1,8 @@
 from typing import List, Literal, Optional
 
-from beanie import Link, PydanticObjectId
-from pydantic import BaseModel, Field, computed_field
+from beanie import PydanticObjectId
+from pydantic import BaseModel, Field
 
-from app.models import Business, Group, Permission
 from app.schema import BaseResponse
 from app.schema.branch import BranchResponse
 from app.schema.business import BusinessResponse
@@ -48,11 +47,13 @@ class UserCreate(BaseModel):
     address: Optional[str] = None
     image_url: Optional[str] = None
     role: Literal["Admin", "BusinessOwner", "Staff"] = "Staff"
-    permissions: List[Link[Permission]] = Field(
+    # Chỉ lưu id thô: đường insert không dereference, validate list ObjectId
+    # nhẹ hơn hẳn list Link (Beanie nhận ObjectId cho field Link của model)
+    permissions: List[PydanticObjectId] = Field(
         default_factory=list,
     )
-    group: Link[Group] = None
-    scope: Optional[Link[Business]] = None
+    group: Optional[PydanticObjectId] = None
+    scope: Optional[PydanticObjectId] = None
 
 
 class UserUpdate(BaseModel):
@@ -66,22 +67,16 @@ class Administrator(Auth):
     name: Optional[str] = None
     phone: Optional[str] = None
     address: Optional[str] = None
-
-    @computed_field(return_type=str)
-    @property
-    def role(self) -> str:
-        return "Admin"
+    # Literal hằng thay computed_field: model_dump đi thẳng serializer Rust,
+    # không gọi descriptor Python mỗi lần dump
+    role: Literal["Admin"] = "Admin"
 
 
 class BusinessOwner(Auth):
     name: Optional[str] = None
     phone: Optional[str] = None
     address: Optional[str] = None
-
-    @computed_field(return_type=str)
-    @property
-    def role(self) -> str:
-        return "BusinessOwner"
+    role: Literal["BusinessOwner"] = "BusinessOwner"
 
 
 class Staff(Auth):
@@ -90,11 +85,7 @@ class Staff(Auth):
     address: Optional[str] = None
     email: Optional[str] = None
     branch: PydanticObjectId
-
-    @computed_field(return_type=str)
-    @property
-    def role(self) -> str:
-        return "Staff"
+    role: Literal["Staff"] = "Staff"
 
 
 class BusinessRegister(Auth):
@@ -108,11 +99,7 @@ class BusinessRegister(Auth):
     business_contact: Optional[str] = None
     business_type: PydanticObjectId
     business_tax_code: Optional[str] = Field(default=None, description="Business tax code")
-
-    @computed_field(return_type=str)
-    @property
-    def role(self) -> str:
-        return "BusinessOwner"
+    role: Literal["BusinessOwner"] = "BusinessOwner"
 
 
 class FullUserResponse(BaseResponse):
@@ -141,3 +128,16 @@ class UserResponse(BaseResponse):
     role: Optional[str] = None
     branch: Optional[BranchResponse] = None
     available: bool
+
+
+class PublicUserResponse(BaseResponse):
+    # Bản rút gọn cho endpoint công khai: không kéo branch từ DB (projection bỏ hẳn field)
+    username: Optional[str] = None
+    name: Optional[str] = None
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    email_verified: bool
+    address: Optional[str] = None
+    image_url: Optional[str] = None
+    role: Optional[str] = None
+    available: bool
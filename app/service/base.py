@@ -1,9 +1,12 @@
 from contextlib import asynccontextmanager
-from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Generic, List, Optional, Type, TypeVar, Union
 
-from beanie import Document
+from beanie import Document, PydanticObjectId
+from beanie.odm.fields import LinkTypes
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorClientSession
 from pydantic import BaseModel
+from pymongo import ReturnDocument
 from pymongo.errors import PyMongoError
 
 ModelType = TypeVar("ModelType", bound=Document)
@@ -11,6 +14,23 @@ CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
 
 
+def _encode_value(value: Any) -> Any:
+    """Đổi Document/Link thành DBRef, model lồng thành dict để ghi thẳng qua driver."""
+    if isinstance(value, Document) or hasattr(value, "to_ref"):
+        return value.to_ref()
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, list):
+        return [_encode_value(item) for item in value]
+    return value
+
+
+def _partial_dict(data: BaseModel) -> Dict[str, Any]:
+    # Chỉ nhặt field client thực sự gửi: đọc thẳng __pydantic_fields_set__,
+    # khỏi chạy cả máy model_dump (alias/serializer/computed) cho patch vài field
+    return {key: getattr(data, key) for key in data.__pydantic_fields_set__}
+
+
 class Service(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     def __init__(self, model: Type[ModelType]):
         self.model = model
@@ -36,13 +56,16 @@ class Service(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         projection_model: None = None,
         fetch_links: bool = False,
         session: AsyncIOMotorClientSession | None = None,
+        collation: Dict[str, Any] | None = None,
     ) -> Optional[ModelType]:
         conditions = conditions or {}
+        kwargs = {"collation": collation} if collation else {}
         return await self.model.find_one(
             conditions,
             projection_model=projection_model,
             fetch_links=fetch_links,
             session=session,
+            **kwargs,
         )
 
     # 3. Tìm nhiều document theo điều kiện
@@ -51,6 +74,7 @@ class Service(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         conditions: Dict[str, Any] | None = None,
         skip: int | None = None,
         limit: int | None = None,
+        sort: Any = None,
         projection_model: None = None,
         fetch_links: bool = False,
         session: AsyncIOMotorClientSession | None = None,
@@ -60,20 +84,92 @@ class Service(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             conditions,
             skip=skip,
             limit=limit,
+            sort=sort,
             projection_model=projection_model,
             fetch_links=fetch_links,
             session=session,
         ).to_list()
 
+    # 3a. Duyệt document qua cursor: RAM chỉ giữ từng batch thay vì cả result set
+    async def iter_many(
+        self,
+        conditions: Dict[str, Any] | None = None,
+        sort: Any = None,
+        projection_model: None = None,
+        fetch_links: bool = False,
+        session: AsyncIOMotorClientSession | None = None,
+    ) -> AsyncIterator[ModelType]:
+        conditions = conditions or {}
+        async for doc in self.model.find_many(
+            conditions,
+            sort=sort,
+            projection_model=projection_model,
+            fetch_links=fetch_links,
+            session=session,
+        ):
+            yield doc
+
+    # 3c. Join toàn bộ Link trực tiếp bằng $lookup trong 1 aggregation, thay cho
+    # fetch_links vốn bắn 1 query phụ mỗi Link của mỗi document (N+1)
+    async def find_many_joined(
+        self,
+        conditions: Dict[str, Any] | None = None,
+        skip: int | None = None,
+        limit: int | None = None,
+        sort: List[tuple] | None = None,
+        session: AsyncIOMotorClientSession | None = None,
+    ) -> List[Dict[str, Any]]:
+        pipeline: List[Dict[str, Any]] = [{"$match": conditions or {}}]
+        if sort:
+            pipeline.append({"$sort": dict(sort)})
+        if skip:
+            pipeline.append({"$skip": skip})
+        if limit:
+            pipeline.append({"$limit": limit})
+        # Metadata link chỉ có sau init_beanie nên đọc tại thời điểm gọi
+        for field, link in (self.model.get_link_fields() or {}).items():
+            if link.link_type not in (LinkTypes.DIRECT, LinkTypes.OPTIONAL_DIRECT, LinkTypes.LIST, LinkTypes.OPTIONAL_LIST):
+                continue  # back-link không lưu trên document này
+            pipeline.append(
+                {
+                    "$lookup": {
+                        "from": link.document_class.get_collection_name(),
+                        "localField": f"{field}.$id",
+                        "foreignField": "_id",
+                        "as": field,
+                    }
+                }
+            )
+            if link.link_type in (LinkTypes.DIRECT, LinkTypes.OPTIONAL_DIRECT):
+                pipeline.append({"$unwind": {"path": f"${field}", "preserveNullAndEmptyArrays": True}})
+        return await self.aggregate(pipeline, session=session)
+
+    # 3b. Aggregation pipeline (trả về dict thô, tự $project theo nhu cầu)
+    async def aggregate(
+        self,
+        pipeline: List[Dict[str, Any]],
+        session: AsyncIOMotorClientSession | None = None,
+    ) -> List[Dict[str, Any]]:
+        return await self.model.aggregate(
+            pipeline,
+            session=session,
+        ).to_list()
+
     # 4. Ghi 1 document
     async def insert(
         self,
         data: Union[dict, CreateSchemaType],
         session: AsyncIOMotorClientSession | None = None,
     ) -> ModelType:
-        if isinstance(data, BaseModel):
-            data = data.model_dump()
-        doc = self.model(**data)
+        if isinstance(data, self.model):
+            # Đã là document đích (validate lúc dựng): ghi thẳng, không dump/validate lại
+            doc = data
+        elif isinstance(data, BaseModel):
+            # Validate thẳng trên __dict__: 1 lượt pydantic-core, bỏ bước
+            # model_dump serialize trung gian rồi validate lại
+            doc = self.model.model_validate(data.__dict__)
+        else:
+            doc = self.model.model_validate(data)
         await doc.insert(
             session=session,
         )
@@ -84,42 +180,119 @@ class Service(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         self,
         data: List[Union[dict, CreateSchemaType]],
         session: AsyncIOMotorClientSession | None = None,
+        ordered: bool = True,
     ) -> List[ModelType]:
         docs = []
         for object in data:
+            if isinstance(object, self.model):
+                # Đã là document đích: bỏ vòng dump + validate lại từng item
+                docs.append(object)
+                continue
             if isinstance(object, BaseModel):
                 object = object.model_dump()
             docs.append(self.model(**object))
+        # ordered=False cho seed không quan trọng thứ tự: server ghi song song
+        # và không dừng cả batch khi 1 document lỗi
         return await self.model.insert_many(
             documents=docs,
             session=session,
+            ordered=ordered,
         )
 
-    # 6. Cập nhật theo ID
+    # 6. Cập nhật theo ID: find_one_and_update trả về doc mới trong 1 round-trip
     async def update(
         self,
         id: Any,
         data: Union[dict, UpdateSchemaType],
         session: AsyncIOMotorClientSession | None = None,
     ) -> Optional[ModelType]:
-        db_item = await self.model.get(id, session=session)
-        if not db_item:
-            return None
+        if isinstance(id, str) and PydanticObjectId.is_valid(id):
+            id = PydanticObjectId(id)
         if isinstance(data, BaseModel):
-            data = data.model_dump(exclude_unset=True)
-        for key, value in data.items():
-            setattr(db_item, key, value)
-        await db_item.save(session=session)
-        return db_item
+            data = _partial_dict(data)
+        data = {key: _encode_value(value) for key, value in data.items()}
+        data["updated_at"] = datetime.now()
+        raw = await self.model.get_pymongo_collection().find_one_and_update(
+            {"_id": id},
+            {"$set": data},
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+        if raw is None:
+            return None
+        return self.model.model_validate(raw)
 
+    # Cập nhật bằng raw operator ($pull/$inc/...): find_one_and_update trả luôn
+    # doc mới, bỏ round-trip get(id) đọc lại sau khi ghi
     async def update_one(
         self, id: Any, conditions: Dict[str, Any], session: AsyncIOMotorClientSession | None = None
     ) -> Optional[ModelType]:
-        await self.model.find_one(
+        raw = await self.model.get_pymongo_collection().find_one_and_update(
             {"_id": id},
+            conditions,
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+        if raw is None:
+            return None
+        return self.model.model_validate(raw)
+
+    # 6a. Cập nhật theo điều kiện (gộp check sở hữu vào filter): 1 round-trip, atomic
+    async def update_one_where(
+        self,
+        conditions: Dict[str, Any],
+        data: Union[dict, UpdateSchemaType],
+        session: AsyncIOMotorClientSession | None = None,
+    ) -> Optional[ModelType]:
+        if isinstance(data, BaseModel):
+            data = _partial_dict(data)
+        data = {key: _encode_value(value) for key, value in data.items()}
+        data["updated_at"] = datetime.now()
+        raw = await self.model.get_pymongo_collection().find_one_and_update(
+            conditions,
+            {"$set": data},
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+        if raw is None:
+            return None
+        return self.model.model_validate(raw)
+
+    # 6b. Cập nhật 1 document theo điều kiện, trả matched_count thay vì đọc lại doc
+    async def update_where(
+        self,
+        conditions: Dict[str, Any],
+        update_data: Dict[str, Any],
+        session: AsyncIOMotorClientSession | None = None,
+    ) -> int:
+        result = await self.model.find_one(
+            conditions,
+            session=session,
+        ).update(update_data, session=session)
+        return result.matched_count
+
+    # 6c. Upsert: cập nhật (hoặc tạo) document theo điều kiện trong 1 round-trip
+    async def upsert(
+        self,
+        conditions: Dict[str, Any],
+        data: Union[dict, CreateSchemaType],
+        session: AsyncIOMotorClientSession | None = None,
+    ) -> ModelType:
+        if isinstance(data, BaseModel):
+            data = data.model_dump()
+        data = {key: _encode_value(value) for key, value in data.items()}
+        # created_at ghi qua $setOnInsert: giữ giá trị cũ khi update, chỉ set
+        # lúc tạo mới — replace trước đây làm field này mất hẳn khỏi document
+        data.pop("created_at", None)
+        data["updated_at"] = datetime.now()
+        raw = await self.model.get_pymongo_collection().find_one_and_update(
+            conditions,
+            {"$set": data, "$setOnInsert": {"created_at": datetime.now()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
             session=session,
-        ).update(conditions)
-        return await self.model.get(id)
+        )
+        return self.model.model_validate(raw)
 
     # 7. Cập nhật nhiều document theo điều kiện
     async def update_many(
@@ -139,6 +312,18 @@ class Service(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         await db_item.delete(session)
         return True
 
+    # 8b. Xóa 1 document theo điều kiện: gộp check sở hữu vào filter, 1 round-trip
+    async def delete_where(
+        self,
+        conditions: Dict[str, Any],
+        session: AsyncIOMotorClientSession | None = None,
+    ) -> bool:
+        raw = await self.model.get_pymongo_collection().find_one_and_delete(
+            conditions,
+            session=session,
+        )
+        return raw is not None
+
     # 9. Xóa nhiều theo điều kiện
     async def delete_many(self, conditions: dict[str, Any], session: AsyncIOMotorClientSession | None = None) -> int:
         result = await self.model.find(
@@ -149,18 +334,29 @@ class Service(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
 
     # 10. Đếm số lượng document theo điều kiện
     async def count(
-        self, conditions: dict[str, Any] | None = None, session: AsyncIOMotorClientSession | None = None
+        self,
+        conditions: dict[str, Any] | None = None,
+        session: AsyncIOMotorClientSession | None = None,
+        hint: Any = None,
     ) -> int:
-        conditions = conditions or {}
-        return await self.model.find(
-            conditions,
-            session=session,
-        ).count()
+        if not conditions and session is None:
+            # Đếm cả collection: estimatedDocumentCount đọc metadata O(1),
+            # khỏi quét index như countDocuments (không dùng được trong session)
+            return await self.model.get_pymongo_collection().estimated_document_count()
+        kwargs = {"hint": hint} if hint else {}
+        return await self.model.get_pymongo_collection().count_documents(
+            conditions or {}, session=session, **kwargs
+        )
 
     # 11. Transaction
     @staticmethod
     @asynccontextmanager
-    async def transaction(client: AsyncIOMotorClient):
+    async def transaction(client: AsyncIOMotorClient, required: bool = True):
+        # required=False cho thao tác 1 document (tự atomic phía Mongo):
+        # bỏ hẳn chi phí mở session + begin/commit transaction
+        if not required:
+            yield None
+            return
         async with client.start_session() as session:
             try:
                 await session.start_transaction()
@@ -7,6 +7,14 @@ class BusinessTypeService(Service[BusinessType, BusinessTypeCreate, BusinessType
     def __init__(self):
         super().__init__(BusinessType)
 
+    async def update(self, id, data, session=None):
+        # update() ghi thẳng qua driver nên hook set_name_lc không chạy, tự duy trì ở đây
+        if isinstance(data, BusinessTypeUpdate):
+            data = data.model_dump(exclude_unset=True)
+        if data.get("name"):
+            data["name_lc"] = data["name"].lower()
+        return await super().update(id, data, session=session)
+
 
 class BusinessService(Service[Business, BusinessCreate, BusinessUpdate]):
     def __init__(self):
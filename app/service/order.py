@@ -1,7 +1,17 @@
+from typing import Optional
+
 from app.models.order import ExtendOrder, Order
 from app.schema.order import ExtenOrderCreate, ExtenOrderUpdate, OrderCreate, OrderUpdate
 from app.service.base import Service
 
+# (field, collection, giá trị thay thế khi reference đã bị xóa)
+_ORDER_RELATIONS = [
+    ("branch", "Branch", {"name": "Không xác định", "address": "Không xác định"}),
+    ("area", "Area", {"name": "Không xác định"}),
+    ("service_unit", "ServiceUnit", {"name": "Không xác định"}),
+    ("request", "Request", None),
+]
+
 
 class ExtendOrderService(Service[ExtendOrder, ExtenOrderCreate, ExtenOrderUpdate]):
     def __init__(self):
@@ -12,6 +22,72 @@ class OrderService(Service[Order, OrderCreate, OrderUpdate]):
     def __init__(self):
         super().__init__(Order)
 
+    @staticmethod
+    def _relation_stages() -> list:
+        # Join branch/area/service_unit/request và điền sẵn fallback
+        # "Không xác định" cho reference đã bị xóa, thay cho fetch_links (N+1 khi
+        # link dangling) + vòng isinstance(Link) hậu xử lý phía Python
+        stages = []
+        for field, collection, default in _ORDER_RELATIONS:
+            stages.append(
+                {
+                    "$lookup": {
+                        "from": collection,
+                        "localField": f"{field}.$id",
+                        "foreignField": "_id",
+                        "as": field,
+                    }
+                }
+            )
+            stages.append({"$unwind": {"path": f"${field}", "preserveNullAndEmptyArrays": True}})
+            if default is not None:
+                stages.append({"$addFields": {field: {"$ifNull": [f"${field}", default]}}})
+        # Trả area kèm branch như khi fetch_links lồng nhau
+        stages.append({"$addFields": {"area.branch": "$branch"}})
+        return stages
+
+    async def find_many_with_relations(
+        self,
+        conditions: dict,
+        skip: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> list:
+        pipeline = [{"$match": conditions}]
+        if skip:
+            pipeline.append({"$skip": skip})
+        if limit:
+            pipeline.append({"$limit": limit})
+        pipeline += self._relation_stages()
+        return await self.aggregate(pipeline)
+
+    async def report(self, conditions: dict) -> dict:
+        # $facet: danh sách đơn + tổng tiền/tổng đơn trong cùng 1 round-trip,
+        # để server cộng dồn thay vì kéo hết document về rồi sum bằng Python
+        pipeline = [
+            {"$match": conditions},
+            {
+                "$facet": {
+                    "orders": self._relation_stages(),
+                    "summary": [
+                        {
+                            "$group": {
+                                "_id": None,
+                                "total_amount": {"$sum": "$amount"},
+                                "total_count": {"$sum": 1},
+                            }
+                        }
+                    ],
+                }
+            },
+        ]
+        result = (await self.aggregate(pipeline))[0]
+        summary = result["summary"][0] if result["summary"] else {}
+        return {
+            "orders": result["orders"],
+            "total_amount": summary.get("total_amount", 0),
+            "total_count": summary.get("total_count", 0),
+        }
+
 
 orderService = OrderService()
 extendOrderService = ExtendOrderService()
@@ -1,12 +1,52 @@
+from typing import Optional
+
 from app.models.request import Request
 from app.schema.request import RequestCreate, RequestUpdate
 from app.service.base import Service
 
+# (field, collection, giá trị thay thế khi reference đã bị xóa)
+_REQUEST_RELATIONS = [
+    ("service_unit", "ServiceUnit", {"name": "Không xác định"}),
+    ("area", "Area", {"name": "Không xác định"}),
+    ("branch", "Branch", {"name": "Không xác định", "address": "Không xác định"}),
+]
+
 
 class RequestService(Service[Request, RequestCreate, RequestUpdate]):
     def __init__(self):
         super().__init__(Request)
 
+    async def find_many_with_relations(
+        self,
+        conditions: dict,
+        skip: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> list:
+        # 1 aggregation join service_unit/area/branch và điền sẵn fallback
+        # "Không xác định", thay cho fetch_links + vòng vá Link dangling phía Python
+        # (cùng pattern với OrderService.find_many_with_relations)
+        pipeline = [{"$match": conditions}, {"$sort": {"_id": -1}}]
+        if skip:
+            pipeline.append({"$skip": skip})
+        if limit:
+            pipeline.append({"$limit": limit})
+        for field, collection, default in _REQUEST_RELATIONS:
+            pipeline.append(
+                {
+                    "$lookup": {
+                        "from": collection,
+                        "localField": f"{field}.$id",
+                        "foreignField": "_id",
+                        "as": field,
+                    }
+                }
+            )
+            pipeline.append({"$unwind": {"path": f"${field}", "preserveNullAndEmptyArrays": True}})
+            pipeline.append({"$addFields": {field: {"$ifNull": [f"${field}", default]}}})
+        # Trả area kèm branch như khi fetch_links lồng nhau
+        pipeline.append({"$addFields": {"area.branch": "$branch"}})
+        return await self.aggregate(pipeline)
+
 
 requestService = RequestService()
 
@@ -1,50 +1,146 @@
+import re
+from typing import Any, List
+
 from motor.motor_asyncio import AsyncIOMotorClientSession
 
 from app.models.user import User
-from app.schema.user import UserCreate, UserUpdate
+from app.schema.user import UserCreate, UserResponse, UserUpdate
 from app.service import permissionService
 
 from .base import Service
 
+# Chỉ kéo đúng các field UserResponse cần (suy từ schema nên tự khớp khi schema đổi):
+# bỏ password hash, mảng permissions/group... khỏi BSON trả về
+_USER_PROJECTION = {field: 1 for field in UserResponse.model_fields if field != "id"}
+
+
+# Bộ quyền mặc định theo vai trò (match=False nghĩa là lấy các code KHÔNG khớp)
+_ROLE_PERMISSION_RULES = {
+    "Admin": (re.compile(r"\.(businesstype|business|plan|group|user|extendorder|permission)$"), True),
+    "BusinessOwner": (re.compile(r"\.(businesstype|business|plan|permission)$"), False),
+    "Staff": (re.compile(r"^view.*(area|branch|order|category|subcategory|serviceunit|product)$"), True),
+}
+
 
 class UserService(Service[User, UserCreate, UserUpdate]):
     def __init__(self):
         super().__init__(User)
+        # Cache quyền đã resolve theo role: bảng permission tĩnh sau khi seed
+        # nên chỉ cần đọc 1 lần mỗi process
+        self._role_permissions: dict = {}
+
+    async def find_scope(self, user_id: Any):
+        # Chỉ kéo DBRef business (+ cờ available) để check quyền sở hữu,
+        # không đọc cả document khi chưa chắc request được phép đi tiếp
+        return await self.model.get_pymongo_collection().find_one(
+            {"_id": user_id}, {"business": 1, "available": 1}
+        )
+
+    async def find_many_with_relations(self, conditions: dict) -> list:
+        # 1 aggregation $lookup branch thay cho fetch_links: Beanie fetch link bằng
+        # 1 query phụ cho mỗi Link của mỗi user (N+1), join server-side chỉ tốn 1 query
+        pipeline = [
+            {"$match": conditions},
+            {"$project": _USER_PROJECTION},
+            {
+                "$lookup": {
+                    "from": "Branch",
+                    "localField": "branch.$id",
+                    "foreignField": "_id",
+                    "as": "branch",
+                }
+            },
+            {"$unwind": {"path": "$branch", "preserveNullAndEmptyArrays": True}},
+        ]
+        return await self.aggregate(pipeline)
+
+    # Gom quyền trực tiếp + quyền theo nhóm trong 1 aggregation duy nhất;
+    # $setUnion/$reduce dedupe ngay trên server nên Python không còn set arithmetic
+    async def resolve_permissions(self, user_id: Any) -> List[str]:
+        results = await self.model.aggregate(
+            [
+                {"$match": {"_id": user_id}},
+                {
+                    "$lookup": {
+                        "from": "Permission",
+                        "localField": "permissions.$id",
+                        "foreignField": "_id",
+                        "as": "direct_permissions",
+                        "pipeline": [{"$project": {"_id": 0, "code": 1}}],
+                    }
+                },
+                {
+                    "$lookup": {
+                        "from": "Group",
+                        "localField": "group.$id",
+                        "foreignField": "_id",
+                        "as": "groups",
+                        "pipeline": [
+                            {
+                                "$lookup": {
+                                    "from": "Permission",
+                                    "localField": "permissions.$id",
+                                    "foreignField": "_id",
+                                    "as": "permissions",
+                                    "pipeline": [{"$project": {"_id": 0, "code": 1}}],
+                                }
+                            },
+                            {"$project": {"permissions": 1}},
+                        ],
+                    }
+                },
+                {
+                    "$project": {
+                        "_id": 0,
+                        "codes": {
+                            "$setUnion": [
+                                "$direct_permissions.code",
+                                {
+                                    "$reduce": {
+                                        "input": "$groups",
+                                        "initialValue": [],
+                                        "in": {"$setUnion": ["$$value", "$$this.permissions.code"]},
+                                    }
+                                },
+                            ]
+                        },
+                    }
+                },
+            ]
+        ).to_list()
+        return results[0]["codes"] if results else []
 
     async def insert(
         self,
         data,
         session: AsyncIOMotorClientSession | None = None,
     ):
-        permissions = []
         if hasattr(data, "model_dump"):
             data = data.model_dump()
-        if data["role"] == "Admin":
-            permissions = await permissionService.find_many(
-                conditions={
-                    "code": {"$regex": r"\.(businesstype|business|plan|group|user|extendorder|permission)$"},
-                },
-                session=session,
-            )
-        if data["role"] == "BusinessOwner":
-            permissions = await permissionService.find_many(
-                conditions={
-                    "code": {
-                        "$not": {"$regex": r"\.(businesstype|business|plan|permission)$"},
-                    },
-                },
-                session=session,
-            )
-        if data["role"] == "Staff":
-            permissions = await permissionService.find_many(
-                conditions={
-                    "code": {"$regex": r"^view.*(area|branch|order|category|subcategory|serviceunit|product)$"}
-                },
-                session=session,
-            )
-        data["permissions"] = permissions
+        data["permissions"] = await self._permissions_for_role(data["role"], session=session)
         return await super().insert(data, session=session)
 
+    async def _permissions_for_role(self, role: str, session: AsyncIOMotorClientSession | None = None) -> List:
+        # $regex với alternation/$not không ăn index -> Mongo quét cả collection
+        # mỗi lần tạo user. Đọc toàn bộ permission đúng 1 lần, lọc bằng regex đã
+        # biên dịch phía Python rồi cache theo role (bảng quyền tĩnh sau khi seed).
+        rule = _ROLE_PERMISSION_RULES.get(role)
+        if rule is None:
+            return []
+        cached = self._role_permissions.get(role)
+        if cached is not None:
+            return cached
+        pattern, match = rule
+        # Cache document đã fetch (không phải id thô): Link chưa fetch sẽ làm
+        # FullUserResponse validate fail ở các handler trả user ngay sau insert
+        permissions = [
+            permission
+            for permission in await permissionService.find_many(session=session)
+            if bool(pattern.search(permission.code)) is match
+        ]
+        self._role_permissions[role] = permissions
+        return permissions
+
 
 userService = UserService()
 